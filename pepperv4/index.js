@@ -7,6 +7,8 @@ import { fileURLToPath } from 'url';
 import { config } from './config.js';
 import { runModel } from './pipeline/model-runner.js';
 import { runPipeline } from './pipeline/orchestrator.js';
+import { startMlRunner } from './pipeline/ml-runner.js';
+import { routePrompt } from './util/fast-path.js';
 import * as registry from './util/process-registry.js';
 import * as clarifications from './memory/clarification-manager.js';
 import { detectSiteContext } from './memory/memory-manager.js';
@@ -14,6 +16,12 @@ import { detectSiteContext } from './memory/memory-manager.js';
 const __dirname = dirname(fileURLToPath(import.meta.url));
 const MEMORY_ROOT = join(__dirname, '..', 'pepperv1', 'backend', 'bot', 'memory');
 
+// Warm the local ML subprocess at boot so the first request doesn't pay for it.
+// Set PEPPER_ML_EAGER=false to keep the old lazy start (e.g. in short-lived scripts).
+if (process.env.PEPPER_ML_EAGER !== 'false') {
+  startMlRunner().catch(err => process.stderr.write(`[pepperv4] ML prewarm failed: ${err.message}\n`));
+}
+
 // Employee definitions — backward compat with pepperv1's delegation system
 const EMPLOYEES = {
   coder: {
@@ -147,7 +155,14 @@ export async function executeClaudePrompt(prompt, options = {}) {
     return runDirectExecution(prompt, options);
   }
 
-  // Default: always run the full pipeline (A → B → C → D → learn)
+  // Fast path: one direct call for messages the router judges simple.
+  // PEPPER_FAST_PATH=false sends everything through the pipeline.
+  if (process.env.PEPPER_FAST_PATH !== 'false') {
+    const route = await routePrompt(prompt);
+    if (route.simple) return runDirectExecution(prompt, options);
+  }
+
+  // Full pipeline (A → B → C → D → learn)
   const result = await runPipeline(prompt, {
     onProgress,
     processKey,
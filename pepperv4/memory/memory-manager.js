@@ -83,6 +83,12 @@ export function getContents(selections) {
     const match = inventory.find(m => m.name === sel.name && m.category === sel.category);
     if (!match) return { ...sel, content: '(not found)' };
 
+    // Phase B already picked the relevant passages — pass only those, not the whole file
+    if (Array.isArray(sel.passages) && sel.passages.length > 0) {
+      const content = sel.passages.map(p => p.text).join('\n\n[...]\n\n');
+      return { ...sel, content, path: match.path };
+    }
+
     try {
       const content = readFileSync(match.path, 'utf-8');
       return { ...sel, content, path: match.path };
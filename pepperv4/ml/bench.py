@@ -0,0 +1,301 @@
+"""
+Microbenchmarks for the infer.py hot paths.
+
+Builds synthetic memory corpora (markdown files with log-normal sizes), then times
+Phase A, Phase B and the stateless TF-IDF helpers at each corpus size. Every case
+runs in a fresh spawned process so model load time and peak RSS are per case.
+
+Usage:
+  python ml/bench.py                              # 10, 100, 1k, 10k files
+  python ml/bench.py --sizes 10,100 --budget 2    # quicker run
+  python ml/bench.py --out bench.json             # JSON for comparing commits
+
+Cases (backend in brackets):
+  model_load          [compact, pickle]               construct the Phase A model
+  phase_a             [compact, pickle]               run_phase_a, one prompt per call
+  phase_a_batch       [compact, pickle]               run_phase_a_batch, 256 prompts per call
+  phase_b             [tfidf, tfidf-pure, bm25, lsa]  run_phase_b against a warm index
+  tfidf_cosine        [sklearn, pure]                 _tfidf_cosine / _tfidf_cosine_pure
+"""
+
+import argparse, json, math, os, platform, random, subprocess, sys, tempfile, time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+ML_DIR = Path(__file__).parent
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+BATCH_SIZE = 256
+
+QUERIES = [
+    "how do I deploy the docker server to production",
+    "write a python script that exports my calendar to csv",
+    "make slides about the quarterly marketing budget",
+    "open gmail and archive everything from newsletters",
+    "what did we decide about the react hooks refactor",
+    "summarize my notes on the trip to lisbon",
+    "check disk usage and clean up old log files",
+    "draft an email to the client about the invoice delay",
+]
+
+TOPIC_WORDS = (
+    "deploy docker server python script calendar email gmail invoice client budget "
+    "marketing slides presentation report chart image react hooks typescript notes "
+    "travel flight hotel lisbon music spotify markdown git branch commit review test "
+    "coverage database postgres index query cache latency queue worker cron backup "
+    "logs disk cleanup todoist task reminder meeting agenda summary research paper"
+).split()
+
+
+# ---------------------------------------------------------------------------
+# Synthetic corpus
+# ---------------------------------------------------------------------------
+def _vocabulary(rng, size=5000):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = set(TOPIC_WORDS)
+    while len(words) < size:
+        words.add(''.join(rng.choice(letters) for _ in range(rng.randint(3, 10))))
+    return sorted(words)
+
+
+def _zipf_sampler(rng, words):
+    # Zipf-like word frequencies so documents share a realistic head of common terms
+    weights = [1.0 / (rank + 1) for rank in range(len(words))]
+    shuffled = list(words)
+    rng.shuffle(shuffled)
+    return lambda k: rng.choices(shuffled, weights=weights, k=k)
+
+
+def _markdown(rng, sample, target_bytes):
+    parts = [f"# {' '.join(sample(3)).title()}\n", f"description: {' '.join(sample(8))}\n"]
+    size = sum(len(p) for p in parts)
+    while size < target_bytes:
+        if rng.random() < 0.15:
+            block = f"\n## {' '.join(sample(rng.randint(2, 5))).title()}\n"
+        elif rng.random() < 0.2:
+            block = ''.join(f"- {' '.join(sample(rng.randint(4, 10)))}\n" for _ in range(rng.randint(2, 6)))
+        else:
+            block = ' '.join(sample(rng.randint(30, 90))) + '.\n\n'
+        parts.append(block)
+        size += len(block)
+    return ''.join(parts)
+
+
+def build_corpus(root: Path, n_files: int, seed: int = 0) -> list:
+    """Write n_files markdown memories under root and return their inventory."""
+    rng = random.Random(seed + n_files)
+    sample = _zipf_sampler(rng, _vocabulary(rng))
+    categories = [('skill', 'skills'), ('knowledge', 'knowledge'), ('preference', 'preferences'), ('site', 'sites')]
+    inventory = []
+    for i in range(n_files):
+        category, subdir = categories[i % len(categories)]
+        # Median ~2 KB, long tail up to 64 KB (big SKILL.md files)
+        target = int(min(64_000, max(200, rng.lognormvariate(math.log(2000), 1.0))))
+        name = f'mem-{i:05d}'
+        path = root / subdir / f'{name}.md'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        text = _markdown(rng, sample, target)
+        path.write_text(text, encoding='utf-8')
+        inventory.append({
+            'name': name,
+            'category': category,
+            'description': text.split('\n', 2)[1][len('description: '):],
+            'path': str(path),
+        })
+    return inventory
+
+
+# ---------------------------------------------------------------------------
+# Measurement helpers
+# ---------------------------------------------------------------------------
+def _percentile(sorted_ms: list, p: float) -> float:
+    # Nearest-rank percentile
+    if not sorted_ms:
+        return 0.0
+    k = max(0, min(len(sorted_ms) - 1, math.ceil(p / 100 * len(sorted_ms)) - 1))
+    return sorted_ms[k]
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _time_loop(fn, budget_s: float, min_iters: int, max_iters: int) -> list:
+    samples = []
+    deadline = time.perf_counter() + budget_s
+    while len(samples) < max_iters and (len(samples) < min_iters or time.perf_counter() < deadline):
+        t = time.perf_counter()
+        fn(len(samples))
+        samples.append((time.perf_counter() - t) * 1000)
+    return samples
+
+
+def _summarize(samples: list, items_per_call: int = 1) -> dict:
+    s = sorted(samples)
+    total_s = sum(s) / 1000
+    return {
+        'iterations': len(s),
+        'p50_ms': round(_percentile(s, 50), 3),
+        'p95_ms': round(_percentile(s, 95), 3),
+        'p99_ms': round(_percentile(s, 99), 3),
+        'mean_ms': round(sum(s) / len(s), 3) if s else 0.0,
+        'throughput_per_s': round(len(s) * items_per_call / total_s, 1) if total_s else None,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Cases (each runs inside its own spawned process)
+# ---------------------------------------------------------------------------
+def _run_case(case: str, backend: str, inventory_path: str, budget_s: float, min_iters: int, max_iters: int) -> dict:
+    sys.path.insert(0, str(ML_DIR))
+    # Measure the real work, not result-cache hits
+    os.environ['PEPPER_INFER_CACHE_SIZE'] = '0'
+    t = time.perf_counter()
+    import infer
+    import_ms = (time.perf_counter() - t) * 1000
+
+    inventory = json.loads(Path(inventory_path).read_text()) if inventory_path else []
+    result = {'case': case, 'backend': backend, 'n_docs': len(inventory), 'import_ms': round(import_ms, 1)}
+
+    if case == 'model_load':
+        cls, path = {
+            'compact': (infer._open_compact, infer.COMPACT_MODEL_PATH),
+            'pickle': (infer._PickledModel, infer.MODEL_PATH),
+        }[backend]
+        samples = _time_loop(lambda i: cls(path), budget_s, min_iters, max_iters)
+        result.update(_summarize(samples))
+
+    elif case in ('phase_a', 'phase_a_batch'):
+        path = infer.COMPACT_MODEL_PATH if backend == 'compact' else infer.MODEL_PATH
+        infer._model = (infer._open_compact if backend == 'compact' else infer._PickledModel)(path)
+        prompts = [q.split(' ', 1)[1] + f' {i}' for i, q in enumerate(QUERIES * 32)]
+        if case == 'phase_a':
+            fn = lambda i: infer.run_phase_a(prompts[i % len(prompts)])
+            per_call = 1
+        else:
+            batch = (prompts * (BATCH_SIZE // len(prompts) + 1))[:BATCH_SIZE]
+            fn = lambda i: infer.run_phase_a_batch(batch)
+            per_call = BATCH_SIZE
+        result['rss_before_mb'] = _peak_rss_mb()
+        result.update(_summarize(_time_loop(fn, budget_s, min_iters, max_iters), per_call))
+
+    elif case == 'phase_b':
+        t = time.perf_counter()
+        infer.run_phase_b(QUERIES[0], inventory, backend)
+        result['cold_ms'] = round((time.perf_counter() - t) * 1000, 3)
+        result['rss_before_mb'] = _peak_rss_mb()
+        fn = lambda i: infer.run_phase_b(QUERIES[i % len(QUERIES)], inventory, backend)
+        result.update(_summarize(_time_loop(fn, budget_s, min_iters, max_iters)))
+
+    elif case == 'tfidf_cosine':
+        docs = [infer._read_doc(item) for item in inventory]
+        score = infer._tfidf_cosine if backend == 'sklearn' else infer._tfidf_cosine_pure
+        result['rss_before_mb'] = _peak_rss_mb()
+        fn = lambda i: score(QUERIES[i % len(QUERIES)], docs)
+        result.update(_summarize(_time_loop(fn, budget_s, min_iters, max_iters)))
+
+    else:
+        raise ValueError(f'unknown case: {case}')
+
+    result['peak_rss_mb'] = _peak_rss_mb()
+    return result
+
+
+def _in_fresh_process(*args) -> dict:
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as ex:
+        return ex.submit(_run_case, *args).result()
+
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+def _environment() -> dict:
+    env = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+    for mod in ('numpy', 'scipy', 'sklearn'):
+        try:
+            env[mod] = __import__(mod).__version__
+        except Exception:
+            env[mod] = None
+    try:
+        env['commit'] = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ML_DIR, capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except Exception:
+        env['commit'] = None
+    return env
+
+
+def _print_row(r: dict):
+    rss = r.get('peak_rss_mb')
+    extra = f"  cold {r['cold_ms']:.1f}ms" if 'cold_ms' in r else ''
+    print(
+        f"  {r['case']:<14} {r['backend']:<10} n={r['n_docs']:<6} "
+        f"p50 {r['p50_ms']:>9.3f}ms  p95 {r['p95_ms']:>9.3f}ms  p99 {r['p99_ms']:>9.3f}ms  "
+        f"{r['throughput_per_s'] or 0:>10.1f}/s  rss {rss if rss is not None else '?'}MB{extra}",
+        flush=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help='comma-separated corpus sizes')
+    parser.add_argument('--budget', type=float, default=5.0, help='seconds per case (after min iterations)')
+    parser.add_argument('--min-iters', type=int, default=5)
+    parser.add_argument('--max-iters', type=int, default=2000)
+    parser.add_argument('--cases', default='model_load,phase_a,phase_a_batch,phase_b,tfidf_cosine')
+    parser.add_argument('--out', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    cases = set(args.cases.split(','))
+    timing = (args.budget, args.min_iters, args.max_iters)
+    results = []
+
+    phase_a_cases = [c for c in ('model_load', 'phase_a', 'phase_a_batch') if c in cases]
+    if phase_a_cases:
+        print('Phase A:')
+    for case in phase_a_cases:
+        for backend in ('compact', 'pickle'):
+            try:
+                r = _in_fresh_process(case, backend, None, *timing)
+            except Exception as e:
+                print(f'  {case:<14} {backend:<8} skipped: {e}')
+                continue
+            results.append(r)
+            _print_row(r)
+
+    with tempfile.TemporaryDirectory(prefix='pepper-bench-') as tmp:
+        for n in sizes:
+            print(f'\nPhase B, {n} memory files:')
+            root = Path(tmp) / f'corpus-{n}'
+            inventory = build_corpus(root, n)
+            inventory_path = root / 'inventory.json'
+            inventory_path.write_text(json.dumps(inventory))
+            for case, backends in (('phase_b', ('tfidf', 'tfidf-pure', 'bm25', 'lsa')), ('tfidf_cosine', ('sklearn', 'pure'))):
+                if case not in cases:
+                    continue
+                for backend in backends:
+                    r = _in_fresh_process(case, backend, str(inventory_path), *timing)
+                    r['corpus_mb'] = round(sum(Path(i['path']).stat().st_size for i in inventory) / 1e6, 2)
+                    results.append(r)
+                    _print_row(r)
+
+    report = {'environment': _environment(), 'settings': vars(args), 'results': results}
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+        print(f'\nResults written to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
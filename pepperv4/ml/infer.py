@@ -1,62 +1,621 @@
 """
 Persistent inference subprocess for Phase A (classifier) and Phase B (TF-IDF retrieval).
+The Phase B passage index is kept in memory across calls and refreshed incrementally;
+Phase B returns each selected file with its best-matching passages.
 Reads newline-delimited JSON from stdin, writes newline-delimited JSON to stdout.
 
 Protocol:
   Phase A:  { "task": "phase_a", "prompt": "..." }
+  Phase A (batch):  { "task": "phase_a_batch", "prompts": ["...", ...] }  ->  { "results": [spec, ...] }
+  Route:    { "task": "route", "prompt": "..." }  ->  { "route": "fast" | "pipeline", "p_simple", "confidence" }
   Phase B:  { "task": "phase_b", "prompt": "...", "inventory": [{name, category, description, path}, ...] }
+            optional "backend": "tfidf" | "tfidf-pure" | "bm25" | "lsa" (default PEPPER_RETRIEVAL or tfidf)
+  Phase A+B:  { "task": "phase_ab", "prompt": "...", "inventory": [...] }  ->  { "phase_a": spec, "phase_b": result }
+            both phases in one round trip, sharing one pass of prompt preprocessing
+  Dedupe:   { "task": "dedupe", "inventory": [...] }  ->  { "clusters": [{files, similarity}], "files", "redundant", "threshold" }
+            near-duplicate memory files (MinHash + LSH); phase_b also folds them into one selected entry
+  Stats:    { "task": "stats" }  ->  per-task counters and latency histograms, index size, RSS
+  Reload:   { "task": "reload", "force": false }  ->  { "reloaded": bool, "reason"?, "model": {version, load_ms, validation, ...} }
+
+The Phase A model is hot-reloaded: the artifacts are polled every PEPPER_MODEL_WATCH_S
+seconds (default 2, 0 disables) and a "reload" request forces a check. A new model is
+loaded and smoke-tested alongside the old one, which keeps serving until the swap.
+
+Phase A and Phase B results are memoized in bounded LRU caches keyed on the
+normalized prompt (Phase B also on the index version, which changes whenever a
+memory file does). PEPPER_INFER_CACHE_SIZE sets entries per cache; 0 disables.
+
+Add "timing": true to any request to get a "_timing" block of stage durations (ms)
+on its response.
+
+Startup:  `python infer.py --prewarm` performs every import (including the retrieval
+dependencies, otherwise imported on the first phase_b) and a warm-up inference
+before reading stdin, then writes one line { "event": "ready", "model": ..., "timings": {...} }
+so the caller can hold requests until the process is warm.
+
+Any request may carry an "id"; it is echoed back on the response. Requests with an
+id run on a worker pool and may complete out of order. Requests without one are
+answered inline, in arrival order.
+
+Daemon:  `python infer.py --daemon [--socket PATH]` serves the same protocol to any
+number of clients on a Unix socket (default PEPPER_INFER_SOCKET or
+$TMPDIR/pepper-infer-<uid>.sock); each connection starts with the ready message.
+
+PEPPER_INFER_MEMORY_MB caps the approximate memory held in passage text, index
+vectors and cached results (default 0 = no cap); over it, cold cached results,
+unused indexes and then raw passage text are evicted. "stats" reports usage.
+
+PEPPER_INFER_PROCS=N (or "auto") pre-forks N worker processes after startup that
+share the loaded model copy-on-write; Phase A and route requests with an id are
+spread across them. Passage indexes are not shared: the parent has no inventory
+to build one from before the first request, so each worker that serves phase_b
+builds its own. By default one worker per backend does (retrieval throughput is
+that of one process); PEPPER_INFER_INDEX_REPLICAS=K (or "all") spreads each
+backend's retrieval over K workers at K times the index memory.
 """
 
+import time
+_T_START = time.perf_counter()
+
 import sys
 import json
 import pickle
 import os
+import bisect
+import gc
+import hashlib
+import heapq
+import itertools
+import math
+import multiprocessing
+import re
+import signal
+import socket
+import tempfile
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
 from pathlib import Path
 
+# Startup cost per stage, reported in the --prewarm ready message
+_LOAD_TIMINGS = {}
+
+
+def _ms_since(t0: float) -> float:
+    return round((time.perf_counter() - t0) * 1000, 2)
+
+
+# Stage durations for the request running on this thread; None unless it asked for timing
+_tls = threading.local()
+
+
+def _add_stage(name: str, ms: float):
+    stages = getattr(_tls, 'stages', None)
+    if stages is not None:
+        stages[name] = stages.get(name, 0.0) + ms
+
+
+@contextmanager
+def _stage(name: str):
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add_stage(name, (time.perf_counter() - t) * 1000)
+
+
+_t = time.perf_counter()
+try:
+    import numpy as np
+except ImportError:
+    np = None
+_LOAD_TIMINGS['numpy_ms'] = _ms_since(_t)
+
 # ---------------------------------------------------------------------------
 # Threshold for Phase A label activation.
 # A label is "on" if its predicted probability exceeds this value.
 # If nothing exceeds it, we fall back to the highest-probability label.
+# A model saved by `train.py --search` carries tuned per-label thresholds,
+# which take precedence.
 # ---------------------------------------------------------------------------
 THRESHOLD = 0.38
 
 MODEL_PATH = Path(__file__).parent / 'models' / 'phase_a.pkl'
+COMPACT_MODEL_PATH = Path(__file__).parent / 'models' / 'phase_a.npz'
+ROUTE_MODEL_PATH = Path(__file__).parent / 'models' / 'route.npz'
+WORKERS = int(os.environ.get('PEPPER_INFER_WORKERS', '4'))
+CACHE_SIZE = int(os.environ.get('PEPPER_INFER_CACHE_SIZE', '1024'))
+# Seconds between checks of the model artifacts for a retrained model; 0 disables the watcher
+MODEL_WATCH_S = float(os.environ.get('PEPPER_MODEL_WATCH_S', '2'))
 LABELS = ['text', 'picture', 'command', 'presentation', 'specificFile', 'other']
+# Same token pattern as sklearn's vectorizers
+_TOKEN_RE = re.compile(r'(?u)\b\w\w+\b')
+
 
 # ---------------------------------------------------------------------------
-# Load Phase A model at startup
+# Phase A model formats
 # ---------------------------------------------------------------------------
-try:
-    with open(MODEL_PATH, 'rb') as f:
-        _model = pickle.load(f)
-    _vec = _model['vectorizer']
-    _clf = _model['classifier']
-    _labels = _model.get('labels', LABELS)
-except Exception as e:
-    sys.stderr.write(f'[infer.py] Failed to load Phase A model: {e}\n')
+class _CompactModel:
+    """
+    NumPy-only Phase A model exported by train.py (phase_a.npz): vocabulary, IDF
+    vector and stacked float32 coefficients. Reproduces TfidfVectorizer
+    (lowercase, token pattern, word n-grams, sublinear TF, l2 norm) without sklearn.
+    """
+
+    def __init__(self, path):
+        with np.load(path, allow_pickle=False) as data:
+            self.labels = [str(l) for l in data['labels']]
+            terms = data['vocabulary']
+            self.idf = data['idf']
+            self.W = data['coef']
+            self.b = data['intercept']
+            self.ngram_range = tuple(int(n) for n in data['ngram_range'])
+            self.sublinear_tf = bool(data['sublinear_tf'])
+            self.token_re = re.compile(str(data['token_pattern']))
+            self.thresholds = _read_thresholds(data)
+        self.vocab = {str(t): i for i, t in enumerate(terms)}
+
+    def _features(self, prompt: str):
+        lo, hi = self.ngram_range
+        counts = Counter()
+        if isinstance(prompt, _Prompt) and self.token_re.pattern == _TOKEN_RE.pattern:
+            for gram in prompt.ngrams(lo, hi):
+                j = self.vocab.get(gram)
+                if j is not None:
+                    counts[j] += 1
+        else:
+            tokens = self.token_re.findall(prompt.lower())
+            for n in range(lo, hi + 1):
+                for i in range(len(tokens) - n + 1):
+                    j = self.vocab.get(' '.join(tokens[i:i + n]))
+                    if j is not None:
+                        counts[j] += 1
+        idx = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        tf = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+        if self.sublinear_tf:
+            tf = 1.0 + np.log(tf)
+        w = tf * self.idf[idx]
+        norm = np.sqrt(w @ w)
+        return idx, (w / norm if norm > 0 else w)
+
+    def scores(self, prompts: list):
+        z = np.tile(self.b.astype(np.float64), (len(prompts), 1))
+        for r, prompt in enumerate(prompts):
+            idx, w = self._features(prompt)
+            if len(idx):
+                z[r] += w @ self.W[idx]
+        return 1.0 / (1.0 + np.exp(-z))
+
+
+class _HashedModel:
+    """
+    Phase A model trained out of core by train_stream.py (phase_a.npz with a
+    hashed feature space instead of a vocabulary): HashingVectorizer settings
+    plus the non-zero rows of the stacked SGD coefficients. Needs sklearn for
+    the hashing, which the Phase B index imports anyway.
+    """
+
+    def __init__(self, path):
+        from scipy import sparse
+        from sklearn.feature_extraction.text import HashingVectorizer
+        with np.load(path, allow_pickle=False) as data:
+            self.labels = [str(l) for l in data['labels']]
+            rows = data['rows']
+            coef = data['coef']
+            self.b = data['intercept'].astype(np.float64)
+            n_features = int(data['n_features'])
+            self.ngram_range = tuple(int(n) for n in data['ngram_range'])
+            params = {
+                'n_features': n_features,
+                'binary': bool(data['binary']),
+                'norm': str(data['norm']),
+                'alternate_sign': bool(data['alternate_sign']),
+            }
+            token_pattern = str(data['token_pattern'])
+            self.thresholds = _read_thresholds(data)
+        n_labels = len(self.labels)
+        self.W = sparse.csr_matrix(
+            (coef.ravel(), (np.repeat(rows, n_labels), np.tile(np.arange(n_labels), len(rows)))),
+            shape=(n_features, n_labels),
+        )
+        self.vec = HashingVectorizer(ngram_range=self.ngram_range, token_pattern=token_pattern, **params)
+        # For _Prompt inputs: hash the n-grams it already produced (same features)
+        self.gram_vec = HashingVectorizer(analyzer=list, **params) if token_pattern == _TOKEN_RE.pattern else None
+
+    def scores(self, prompts: list):
+        if self.gram_vec is not None and all(isinstance(p, _Prompt) for p in prompts):
+            X = self.gram_vec.transform([p.ngrams(*self.ngram_range) for p in prompts])
+        else:
+            X = self.vec.transform(prompts)
+        z = (X @ self.W).toarray() + self.b
+        return 1.0 / (1.0 + np.exp(-z))
+
+
+def _read_thresholds(data):
+    """Per-label activation thresholds saved with the model, or None to use THRESHOLD."""
+    return [round(float(t), 4) for t in data['thresholds']] if 'thresholds' in data.files else None
+
+
+def _open_compact(path):
+    """phase_a.npz in whichever compact format train.py or train_stream.py wrote."""
+    with np.load(path, allow_pickle=False) as data:
+        hashed = 'n_features' in data.files
+    return _HashedModel(path) if hashed else _CompactModel(path)
+
+
+class _PickledModel:
+    """Full sklearn TfidfVectorizer + MultiOutputClassifier pickled by train.py (phase_a.pkl)."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            model = pickle.load(f)
+        self.vec = model['vectorizer']
+        self.clf = model['classifier']
+        self.labels = model.get('labels', LABELS)
+        self.thresholds = model.get('thresholds')
+        self.W, self.b = _stack_linear(self.clf)
+
+    def scores(self, prompts: list):
+        X = self.vec.transform(prompts)
+        if self.W is not None:
+            # Same as LogisticRegression.predict_proba: sigmoid of the decision function
+            z = np.asarray(X @ self.W) + self.b
+            return 1.0 / (1.0 + np.exp(-z))
+        probas = self.clf.predict_proba(X)  # list of arrays, one per label
+        return np.column_stack([p[:, 1] for p in probas])
+
+
+def _stack_linear(clf):
+    """
+    Stack the per-label LogisticRegression weights into one (n_features, n_labels)
+    matrix so every label is scored in a single mat-mul. Returns (None, None) if
+    the estimators are not linear, in which case predict_proba is used instead.
+    """
+    try:
+        W = np.column_stack([est.coef_[0] for est in clf.estimators_])
+        b = np.array([est.intercept_[0] for est in clf.estimators_])
+        return W, b
+    except Exception:
+        return None, None
+
+
+# ---------------------------------------------------------------------------
+# Load Phase A model at startup: the compact artifact if present (no sklearn
+# import needed unless it is train_stream.py's hashed variant), otherwise the pickle.
+# ---------------------------------------------------------------------------
+def _load_model():
+    errors = []
+    for path, cls in ((COMPACT_MODEL_PATH, _open_compact), (MODEL_PATH, _PickledModel)):
+        try:
+            model = cls(path)
+        except Exception as e:
+            errors.append(f'{path.name}: {e}')
+            continue
+        with open(path, 'rb') as f:
+            model.version = hashlib.sha256(f.read()).hexdigest()[:12]
+        model.path = path
+        return model
+    _log(f'Failed to load Phase A model: {"; ".join(errors)}')
+    return None
+
+
+def _log(message: str):
+    sys.stderr.write(f'[infer.py] {message}\n')
     sys.stderr.flush()
-    _vec = None
-    _clf = None
-    _labels = LABELS
+
+
+def _artifacts_signature() -> tuple:
+    """(mtime_ns, size) of each model artifact; changes whenever train.py writes one."""
+    sig = []
+    for path in (COMPACT_MODEL_PATH, MODEL_PATH):
+        try:
+            st = os.stat(path)
+            sig.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            sig.append(None)
+    return tuple(sig)
+
+
+_t = time.perf_counter()
+_model_signature = _artifacts_signature()
+_model = _load_model()
+_LOAD_TIMINGS['model_ms'] = _ms_since(_t)
+
+
+# ---------------------------------------------------------------------------
+# Phase A hot reload. A new model is loaded off to the side (by the watcher
+# thread or a "reload" request), validated on SMOKE_TESTS, and swapped in with
+# one assignment to _model. Requests read _model once and keep that reference,
+# so in-flight calls finish on the model they started with.
+# ---------------------------------------------------------------------------
+# (prompt, acceptable labels): passes if any of them is switched on
+SMOKE_TESTS = [
+    ("explain machine learning", ["text"]),
+    ("draw me a cat", ["picture"]),
+    ("open Chrome", ["command"]),
+    ("create a presentation about React", ["presentation"]),
+    ("write a Python script and save as script.py", ["command", "specificFile"]),
+    ("tell me a joke", ["other"]),
+]
+
+_reload_lock = threading.Lock()  # one load at a time
+_reload_state = {'reloads': 0, 'rejected': 0, 'last_attempt': None, 'last_error': None}
+_attempted_signature = None      # artifacts last tried, so the watcher doesn't retry a rejected model
+
+
+def _validate(model) -> dict:
+    prompts = [prompt for prompt, _ in SMOKE_TESTS]
+    P = model.scores(prompts)
+    if P.shape != (len(prompts), len(model.labels)) or not np.all(np.isfinite(P)):
+        return {'passed': 0, 'total': len(prompts), 'failures': prompts, 'error': 'bad score matrix'}
+    if sorted(model.labels) != sorted(LABELS):
+        return {'passed': 0, 'total': len(prompts), 'failures': prompts, 'error': f'unexpected labels {model.labels}'}
+    failures = []
+    for (prompt, expected), probs in zip(SMOKE_TESTS, P):
+        on = _build_spec(prompt, probs, model.labels, model.thresholds)['outputLabels']
+        if not any(on.get(label) for label in expected):
+            failures.append(prompt)
+    return {'passed': len(prompts) - len(failures), 'total': len(prompts), 'failures': failures}
+
+
+def _model_info(model) -> dict:
+    if model is None:
+        return None
+    return {
+        'format': type(model).__name__,
+        'version': getattr(model, 'version', None),
+        'path': str(getattr(model, 'path', '')),
+        'loaded_at': getattr(model, 'loaded_at', None),
+        'load_ms': getattr(model, 'load_ms', None),
+        'validation': getattr(model, 'validation', None),
+        'thresholds': dict(zip(model.labels, model.thresholds)) if model.thresholds else THRESHOLD,
+    }
+
+
+def reload_model(force: bool = False) -> dict:
+    """
+    Load the current artifacts and swap them in if they validate. A candidate must
+    produce a finite score matrix over the expected labels and pass at least as
+    many smoke tests as the model it replaces. Without force, unchanged artifacts
+    are not reloaded.
+    """
+    global _model, _model_signature, _attempted_signature
+    with _reload_lock:
+        current = _model
+        sig = _artifacts_signature()
+        if not force and sig == _model_signature:
+            return {'reloaded': False, 'reason': 'unchanged', 'model': _model_info(current)}
+        _attempted_signature = sig
+        _reload_state['last_attempt'] = time.time()
+
+        t = time.perf_counter()
+        candidate = _load_model()
+        load_ms = _ms_since(t)
+        if candidate is None:
+            _reload_state['rejected'] += 1
+            _reload_state['last_error'] = 'load failed'
+            return {'reloaded': False, 'reason': 'load failed', 'model': _model_info(current)}
+
+        validation = _validate(candidate)
+        baseline = getattr(current, 'validation', None) or {'passed': 0}
+        if 'error' in validation or validation['passed'] < baseline['passed']:
+            _reload_state['rejected'] += 1
+            _reload_state['last_error'] = validation.get('error') or f"smoke tests {validation['passed']}/{validation['total']}"
+            return {
+                'reloaded': False,
+                'reason': 'validation failed',
+                'validation': validation,
+                'model': _model_info(current),
+            }
+
+        candidate.loaded_at = time.time()
+        candidate.load_ms = load_ms
+        candidate.validation = validation
+        _model = candidate
+        _model_signature = sig
+        # Cache keys carry the model version, so this only releases the old entries
+        _phase_a_cache.clear()
+        _reload_state['reloads'] += 1
+        _reload_state['last_error'] = None
+        return {
+            'reloaded': True,
+            'previous': getattr(current, 'version', None),
+            'model': _model_info(candidate),
+        }
+
+
+def _watch_model():
+    """Poll the artifacts; reload once a change has been stable for one interval."""
+    previous = _model_signature
+    while True:
+        time.sleep(MODEL_WATCH_S)
+        sig = _artifacts_signature()
+        stable, previous = sig == previous, sig
+        if not stable or sig == _model_signature or sig == _attempted_signature:
+            continue
+        try:
+            result = reload_model()
+        except Exception as e:
+            _log(f'Model reload failed: {e}')
+            continue
+        if result['reloaded']:
+            info = result['model']
+            _log(f"Reloaded Phase A model {info['version']} ({info['format']}, {info['load_ms']}ms, "
+                 f"smoke tests {info['validation']['passed']}/{info['validation']['total']})")
+        else:
+            _log(f"Kept Phase A model {result['model'] and result['model']['version']}: {result['reason']}")
+
+
+# ---------------------------------------------------------------------------
+# Result caches
+# ---------------------------------------------------------------------------
+class _LRUCache:
+    """
+    Thread-safe bounded LRU map with hit/miss/eviction counters. capacity <= 0
+    disables it. With sizeof, the approximate bytes held are tracked in .bytes
+    so the memory budget can evict from it.
+    """
+
+    def __init__(self, capacity: int, sizeof=None):
+        self.capacity = capacity
+        self.sizeof = sizeof
+        self._data = OrderedDict()   # key -> (value, size)
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+        self.bytes = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        if self.capacity <= 0:
+            return
+        size = self.sizeof(value) if self.sizeof else 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._data[key] = (value, size)
+            self.bytes += size
+            while len(self._data) > self.capacity:
+                self._pop_oldest()
+
+    def _pop_oldest(self):
+        self.bytes -= self._data.popitem(last=False)[1][1]
+        self.evictions += 1
+
+    def evict_oldest(self) -> bool:
+        """Drop the least recently used entry; False if there was none."""
+        with self._lock:
+            if not self._data:
+                return False
+            self._pop_oldest()
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                **({'mb': _mb(self.bytes)} if self.sizeof else {}),
+            }
+
+
+def _mb(n_bytes: int) -> float:
+    return round(n_bytes / 2 ** 20, 2)
+
+
+def _normalize_prompt(prompt: str) -> str:
+    if isinstance(prompt, _Prompt):
+        return prompt.key
+    # Both vectorizers lowercase and split on whitespace, so this never changes a score
+    return ' '.join(prompt.lower().split())
+
+
+class _Prompt(str):
+    """
+    A prompt preprocessed once for every consumer in a request: the cache key,
+    the word tokens (sklearn's pattern, lowercased) and their n-grams. It is a
+    str, so code that has no use for the shared work still sees plain text.
+    """
+
+    def __new__(cls, text: str):
+        self = super().__new__(cls, text)
+        lower = text.lower()
+        self.key = ' '.join(lower.split())
+        self.tokens = _TOKEN_RE.findall(lower)
+        self._ngrams = {}
+        return self
+
+    def ngrams(self, lo: int, hi: int) -> list:
+        """Word n-grams in the order sklearn's analyzer emits them."""
+        grams = self._ngrams.get((lo, hi))
+        if grams is None:
+            tokens = self.tokens
+            grams = list(tokens) if lo == 1 else []
+            for n in range(max(lo, 2), hi + 1):
+                grams.extend(' '.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+            self._ngrams[(lo, hi)] = grams
+        return grams
+
+
+# Phase A caches label probabilities keyed on (model version, prompt) (the spec echoes
+# the raw prompt, so it is rebuilt); Phase B caches whole results keyed on (prompt, index version)
+_phase_a_cache = _LRUCache(CACHE_SIZE)
+_phase_b_cache = _LRUCache(CACHE_SIZE, sizeof=lambda result: _result_bytes(result))
 
 
 # ---------------------------------------------------------------------------
 # Phase A: multi-label output type classifier
 # ---------------------------------------------------------------------------
+def _cached_scores(model, prompts: list) -> list:
+    """Label probabilities per prompt, scoring only the cache misses (in one pass)."""
+    version = getattr(model, 'version', None)
+    keys = [(version, _normalize_prompt(p)) for p in prompts]
+    rows = [_phase_a_cache.get(k) for k in keys]
+    missing = [i for i, row in enumerate(rows) if row is None]
+    if missing:
+        # Probability of class=1 for every (prompt, label) pair, shape (n_missing, n_labels)
+        P = model.scores([prompts[i] for i in missing])
+        for i, probs in zip(missing, P):
+            rows[i] = tuple(float(p) for p in probs)
+            _phase_a_cache.put(keys[i], rows[i])
+    return rows
+
+
 def run_phase_a(prompt: str) -> dict:
-    if _vec is None or _clf is None:
+    model = _model  # one read: a concurrent reload must not switch models mid-request
+    if model is None:
         # Fallback if model failed to load
         return _fallback_spec(prompt)
 
-    X = _vec.transform([prompt])
-    probas = _clf.predict_proba(X)  # list of arrays, one per label
+    with _stage('classify'):
+        probs = _cached_scores(model, [prompt])[0]
+    with _stage('format'):
+        return _build_spec(prompt, probs, model.labels, model.thresholds)
 
-    scores = {}
-    for i, label in enumerate(_labels):
-        scores[label] = float(probas[i][0][1])  # probability of class=1
+
+def run_phase_a_batch(prompts: list) -> dict:
+    """Classify many prompts with one transform and one scoring pass; results keep input order."""
+    if not isinstance(prompts, list):
+        # A string would otherwise be classified character by character
+        return {'error': f'phase_a_batch needs "prompts" as a list, got {type(prompts).__name__}'}
+    prompts = [p if isinstance(p, str) else str(p) for p in prompts]
+    model = _model
+    if model is None:
+        return {'results': [_fallback_spec(p) for p in prompts]}
+    if not prompts:
+        return {'results': []}
+
+    with _stage('classify'):
+        rows = _cached_scores(model, prompts)
+    with _stage('format'):
+        return {'results': [_build_spec(prompt, row, model.labels, model.thresholds) for prompt, row in zip(prompts, rows)]}
+
+
+def _build_spec(prompt: str, probs, labels: list, thresholds: list = None) -> dict:
+    scores = {label: float(probs[i]) for i, label in enumerate(labels)}
+    cutoffs = dict(zip(labels, thresholds)) if thresholds else {}
 
     # Apply threshold; if nothing activates, take the argmax
-    labels_on = {k: v >= THRESHOLD for k, v in scores.items()}
+    labels_on = {k: v >= cutoffs.get(k, THRESHOLD) for k, v in scores.items()}
     if not any(labels_on.values()):
         best = max(scores, key=scores.get)
         labels_on[best] = True
@@ -94,9 +653,978 @@ def _fallback_spec(prompt: str) -> dict:
 
 
 # ---------------------------------------------------------------------------
-# Phase B: TF-IDF cosine similarity file retrieval
+# Route: fast path (one model call) vs the full pipeline. A binary compact
+# model from train.py; p(simple) >= ROUTE_THRESHOLD takes the fast path, and
+# confidence is the probability of the chosen side.
+# ---------------------------------------------------------------------------
+ROUTE_THRESHOLD = 0.5
+
+
+def _load_route_model():
+    try:
+        return _CompactModel(ROUTE_MODEL_PATH)
+    except Exception as e:
+        _log(f'Route model unavailable ({ROUTE_MODEL_PATH.name}: {e})')
+        return None
+
+
+_t = time.perf_counter()
+_route_model = _load_route_model() if np is not None else None
+_LOAD_TIMINGS['route_model_ms'] = _ms_since(_t)
+
+
+def run_route(prompt: str) -> dict:
+    if _route_model is None:
+        return {'error': 'route model not loaded'}
+    p = float(_route_model.scores([prompt])[0, 0])
+    simple = p >= ROUTE_THRESHOLD
+    return {
+        'route': 'fast' if simple else 'pipeline',
+        'p_simple': round(p, 4),
+        'confidence': round(p if simple else 1 - p, 4),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Phase B: persistent passage index
+# Memory files are read and vectorized once and kept across calls, keyed by
+# path + (mtime, size). Changed files are re-read, deleted ones are dropped,
+# and a query is one transform plus one sparse mat-vec over the cached rows.
+# Each file is split into heading-delimited passages; rows are passages, and a
+# file scores as its best passage.
+# ---------------------------------------------------------------------------
+# Hashed feature space for (1,2)-grams; 2**18 collided badly once bigrams of a few
+# hundred memory files were in play, so keep it at 2**20 (df array is 4 MB)
+N_FEATURES_B = 2 ** 20
+# Only the first MAX_DOC_BYTES of a memory file are read and indexed
+MAX_DOC_BYTES = 512 * 1024
+# Sections longer than this are split further at blank lines (or hard-split at 2x)
+PASSAGE_MAX_CHARS = 2000
+# Where the LSA backend keeps its memory-mapped vectors (anonymous temp files; default system temp)
+LSA_DIR = os.environ.get('PEPPER_LSA_DIR') or None
+
+_HEADING_RE = re.compile(r'^#{1,6}\s+(.*?)\s*#*\s*$')
+_FENCE_RE = re.compile(r'^ {0,3}(`{3,}|~{3,})')
+
+# scipy and sklearn for the hashed backends (tfidf, lsa) are imported on first
+# use, so a process that only classifies never pays for them. --prewarm and
+# --daemon force the import during warm-up.
+sparse = None
+_hasher = None
+_gram_hasher = None
+_retrieval_loaded = False
+_retrieval_lock = threading.Lock()
+
+
+def _load_retrieval() -> bool:
+    """Import the hashed-backend dependencies once; False if they are unavailable."""
+    global sparse, _hasher, _gram_hasher, _retrieval_loaded
+    if _retrieval_loaded:
+        return _hasher is not None
+    with _retrieval_lock:
+        if not _retrieval_loaded:
+            t = time.perf_counter()
+            try:
+                from scipy import sparse as sparse_module
+                from sklearn.feature_extraction.text import HashingVectorizer
+                if np is None:
+                    raise ImportError('numpy')
+                sparse = sparse_module
+                _hasher = HashingVectorizer(
+                    ngram_range=(1, 2), n_features=N_FEATURES_B, alternate_sign=False, norm=None,
+                )
+                # Hashes n-grams a _Prompt already produced; same features as _hasher on its text
+                _gram_hasher = HashingVectorizer(
+                    analyzer=list, n_features=N_FEATURES_B, alternate_sign=False, norm=None,
+                )
+            except Exception:
+                _hasher = _gram_hasher = None
+            _LOAD_TIMINGS['retrieval_imports_ms'] = _ms_since(t)
+            _retrieval_loaded = True
+    return _hasher is not None
+
+
+def _doc_key(item: dict) -> str:
+    # Items without a path are keyed by name so they still get a stable slot
+    return item.get('path') or f"\0{item.get('name', '')}"
+
+
+def _doc_signature(item: dict):
+    path = item.get('path', '')
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except Exception:
+        return ('description', item.get('description', ''))
+
+
+def _read_lines(path: str) -> list:
+    """Stream a file line by line, stopping once MAX_DOC_BYTES have been read."""
+    lines = []
+    remaining = MAX_DOC_BYTES
+    with open(path, 'rb') as f:
+        while remaining > 0:
+            raw = f.readline(remaining)  # bounded even for a file with no newlines
+            if not raw:
+                break
+            remaining -= len(raw)
+            lines.append(raw.decode('utf-8', errors='replace'))
+    return lines
+
+
+def _read_doc(item: dict) -> str:
+    try:
+        return ''.join(_read_lines(item.get('path', '')))
+    except Exception:
+        return item.get('description', '')
+
+
+def _split_passages(lines: list) -> list:
+    """
+    Split markdown lines into passages at headings. Long sections are split again
+    at blank lines once they pass PASSAGE_MAX_CHARS. Each passage is
+    {heading, text, start, end} with 1-based inclusive line numbers. A `#` line
+    inside a fenced code block is a comment, not a heading.
+    """
+    passages = []
+    heading = ''
+    buf, size, start = [], 0, 1
+    fence = None   # the open fence's marker (``` or ~~~, possibly longer) while inside one
+
+    def flush(end):
+        text = ''.join(buf).strip()
+        if text:
+            passages.append({'heading': heading, 'text': text, 'start': start, 'end': end})
+
+    for lineno, line in enumerate(lines, 1):
+        f = _FENCE_RE.match(line)
+        if f and fence is None:
+            fence = f.group(1)
+        elif f and f.group(1).startswith(fence) and not line.strip().strip(fence[0]):
+            # Closed only by the same character, at least as long, with nothing after it
+            fence = None
+        m = _HEADING_RE.match(line) if fence is None and not f else None
+        too_long = size >= PASSAGE_MAX_CHARS and (not line.strip() or size >= 2 * PASSAGE_MAX_CHARS)
+        if m or too_long:
+            flush(lineno - 1)
+            buf, size, start = [], 0, lineno
+            if m:
+                heading = m.group(1)
+        buf.append(line)
+        size += len(line)
+    flush(len(lines))
+    return passages or [{'heading': '', 'text': '', 'start': 1, 'end': len(lines)}]
+
+
+def _load_passages(item: dict) -> list:
+    try:
+        return _split_passages(_read_lines(item.get('path', '')))
+    except Exception:
+        description = item.get('description', '')
+        return [{'heading': '', 'text': description, 'start': 0, 'end': 0}]
+
+
+def _passage_text(name: str, passage: dict) -> str:
+    # The file name and heading carry a lot of the topic, so they are indexed with the body
+    return f"{name}\n{passage['heading']}\n{passage['text']}"
+
+
+# ---------------------------------------------------------------------------
+# Near-duplicate memory files. Each file gets a MinHash signature over its word
+# shingles, and LSH buckets (one per band of the signature) turn "which files
+# look like this one" into a few dict lookups: a new or changed file is compared
+# only with its bucket-mates, never with the whole corpus. Candidates are kept
+# as duplicates if their full signatures estimate Jaccard >= DEDUPE_THRESHOLD.
 # ---------------------------------------------------------------------------
-def run_phase_b(prompt: str, inventory: list) -> dict:
+DEDUPE_THRESHOLD = float(os.environ.get('PEPPER_DEDUPE_THRESHOLD', '0.8'))
+# Signature length. One-permutation hashing: each shingle is hashed once, the top
+# bits pick one of MINHASH_SIZE bins and the rest compete for that bin's minimum,
+# so a signature costs O(shingles) rather than O(shingles x permutations)
+MINHASH_SIZE = 128
+# 32 bands of 4 rows: a pair at Jaccard 0.8 shares a bucket with probability > 0.9999
+LSH_BANDS = 32
+SHINGLE_WORDS = 3
+_EMPTY_BIN = 0xFFFFFFFF
+# A hash's top log2(MINHASH_SIZE) bits pick its bin
+_BIN_SHIFT = 64 - (MINHASH_SIZE - 1).bit_length()
+
+
+def _minhash(text: str):
+    """MinHash signature (uint32, MINHASH_SIZE long) of text's word shingles; None if it has no words."""
+    tokens = _TOKEN_RE.findall(text.lower())
+    if not tokens:
+        return None
+    word_hash = {t: zlib.crc32(t.encode()) for t in set(tokens)}
+    h = np.fromiter(map(word_hash.__getitem__, tokens), dtype=np.uint64, count=len(tokens))
+    n = max(len(h) - SHINGLE_WORDS + 1, 1)
+    x = h[:n].copy()
+    for k in range(1, min(SHINGLE_WORDS, len(h))):
+        # Order-sensitive FNV-style mix of each window of token hashes
+        x = (x * np.uint64(0x01000193) ^ h[k:k + n]) & np.uint64(0xFFFFFFFF)
+    # 64-bit finalizer (splitmix64); uint64 arithmetic wraps
+    x = np.unique(x) + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    bins = (x >> np.uint64(_BIN_SHIFT)).astype(np.intp)
+    sig = np.full(MINHASH_SIZE, _EMPTY_BIN, dtype=np.uint32)
+    np.minimum.at(sig, bins, (x & np.uint64(0xFFFFFFFE)).astype(np.uint32))
+    empty = np.flatnonzero(sig == _EMPTY_BIN)
+    if len(empty):
+        # Densify: an empty bin borrows from the next filled bin to its right (circularly),
+        # offset by the distance so borrowed values stay distinguishable
+        filled = np.flatnonzero(sig != _EMPTY_BIN)
+        pos = np.searchsorted(filled, empty) % len(filled)
+        dist = (filled[pos] - empty) % MINHASH_SIZE
+        sig[empty] = sig[filled[pos]] + (dist * 0x9E3779B1).astype(np.uint32)
+    return sig
+
+
+class _NearDuplicates:
+    """MinHash signatures and LSH buckets for the files of one index, updated file by file."""
+
+    def __init__(self, threshold: float = DEDUPE_THRESHOLD):
+        self.threshold = threshold
+        self._sigs = {}                                  # key -> signature
+        self._buckets = [{} for _ in range(LSH_BANDS)]   # per band: band bytes -> keys
+        self._edges = {}                                 # key -> {key: estimated Jaccard}, duplicates only
+        self.comparisons = 0
+
+    def __len__(self):
+        """Files with at least one near-duplicate."""
+        return len(self._edges)
+
+    def add(self, key: str, text: str):
+        sig = _minhash(text)
+        if sig is None:
+            return
+        self._sigs[key] = sig
+        candidates = set()
+        for band, rows in zip(self._buckets, np.split(sig, LSH_BANDS)):
+            bucket = band.setdefault(rows.tobytes(), set())
+            candidates |= bucket
+            bucket.add(key)
+        self.comparisons += len(candidates)
+        for other in candidates:
+            sim = float(np.count_nonzero(sig == self._sigs[other])) / MINHASH_SIZE
+            if sim >= self.threshold:
+                self._edges.setdefault(key, {})[other] = sim
+                self._edges.setdefault(other, {})[key] = sim
+
+    def remove(self, key: str):
+        sig = self._sigs.pop(key, None)
+        if sig is None:
+            return
+        for band, rows in zip(self._buckets, np.split(sig, LSH_BANDS)):
+            bucket = band[rows.tobytes()]
+            bucket.discard(key)
+            if not bucket:
+                del band[rows.tobytes()]
+        for other in self._edges.pop(key, {}):
+            twins = self._edges[other]
+            del twins[key]
+            if not twins:
+                del self._edges[other]
+
+    def neighbors(self, key: str) -> dict:
+        return self._edges.get(key, {})
+
+    def clusters(self) -> list:
+        """Connected components of the duplicate graph as (sorted keys, lowest pair similarity), largest first."""
+        seen = set()
+        clusters = []
+        for start in self._edges:
+            if start in seen:
+                continue
+            seen.add(start)
+            stack, keys, lowest = [start], [], 1.0
+            while stack:
+                key = stack.pop()
+                keys.append(key)
+                for other, sim in self._edges[key].items():
+                    lowest = min(lowest, sim)
+                    if other not in seen:
+                        seen.add(other)
+                        stack.append(other)
+            clusters.append((sorted(keys), lowest))
+        clusters.sort(key=lambda c: (-len(c[0]), c[0]))
+        return clusters
+
+
+# Rough CPython costs for the pure-Python structures, for the memory budget
+_DICT_ITEM_BYTES = 100    # one term -> number dict slot, key and value included
+_POSTING_BYTES = 60       # one BM25 posting: two list slots, an int and a tuple slot
+
+
+def _passages_bytes(passages: list) -> int:
+    return sum(sys.getsizeof(p) + sys.getsizeof(p['heading']) + sys.getsizeof(p['text']) for p in passages)
+
+
+def _csr_bytes(X) -> int:
+    return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+
+
+class _DocIndex:
+    """
+    Phase B corpus cached across requests. Subclasses own the vector
+    representation; this base class only tracks which files are current.
+    """
+
+    def __init__(self):
+        self._entries = {}   # key -> entry dict
+        self._stale = True   # corpus changed since last _rebuild()
+        self.version = 0     # bumped on every corpus change; part of the Phase B cache key
+        self.dupes = _NearDuplicates() if np is not None else None
+        # Approximate bytes held, for the memory budget (entries carry their own share)
+        self.text_bytes = 0
+        self.vector_bytes = 0
+        self.texts_dropped = 0
+        self.last_used = time.monotonic()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def passage_count(self) -> int:
+        return sum(len(e['passages']) for e in self._entries.values())
+
+    def memory_usage(self) -> dict:
+        return {'text': self.text_bytes, 'vectors': self.vector_bytes + self._index_bytes()}
+
+    def _index_bytes(self) -> int:
+        """Bytes in structures shared by all entries (matrices, df arrays); 0 unless overridden."""
+        return 0
+
+    def _set_passages(self, entry: dict, passages: list, dropped: bool = False):
+        size = _passages_bytes(passages)
+        self.text_bytes += size - entry.get('text_bytes', 0)
+        self.texts_dropped += int(dropped) - int(entry.get('text_dropped', False))
+        entry['passages'] = passages
+        entry['text_bytes'] = size
+        entry['text_dropped'] = dropped
+
+    def drop_text(self, entry: dict) -> int:
+        """
+        Free an entry's raw passage text, keeping its vectors and line ranges.
+        Returns the bytes freed. Only files on disk qualify, since the text must
+        be re-readable by restore_text().
+        """
+        if entry.get('text_dropped') or entry['key'].startswith('\0'):
+            return 0
+        before = entry['text_bytes']
+        self._set_passages(entry, [dict(p, text=None) for p in entry['passages']], dropped=True)
+        return before - entry['text_bytes']
+
+    def restore_text(self, entry: dict) -> bool:
+        """Re-read text dropped by drop_text(); call under the index lock, after sync()."""
+        fresh = _load_passages({'path': entry['key']})
+        if [(p['start'], p['end']) for p in fresh] != [(p['start'], p['end']) for p in entry['passages']]:
+            # Changed on disk since sync(); the next sync() re-indexes it
+            return False
+        self._set_passages(entry, fresh)
+        return True
+
+    def _discard(self, entry: dict):
+        self._remove(entry)
+        if self.dupes is not None:
+            self.dupes.remove(entry['key'])
+        self.text_bytes -= entry['text_bytes']
+        self.vector_bytes -= entry['vec_bytes']
+        self.texts_dropped -= int(entry['text_dropped'])
+
+    def sync(self, inventory: list) -> list:
+        """Bring the index in line with inventory and return its entries in inventory order."""
+        current = []
+        seen = set()
+        stat_s = read_s = vec_s = dupe_s = 0.0
+        for item in inventory:
+            key = _doc_key(item)
+            t0 = time.perf_counter()
+            sig = _doc_signature(item)
+            stat_s += time.perf_counter() - t0
+            entry = self._entries.get(key)
+            name, category = item.get('name', ''), item.get('category', 'knowledge')
+            if entry is None or entry['sig'] != sig:
+                if entry is not None:
+                    self._discard(entry)
+                entry = {'key': key, 'sig': sig, 'name': name, 'category': category}
+                t0 = time.perf_counter()
+                self._set_passages(entry, _load_passages(item))
+                t1 = time.perf_counter()
+                self._add(entry, [_passage_text(name, p) for p in entry['passages']])
+                self.vector_bytes += entry['vec_bytes']
+                t2 = time.perf_counter()
+                if self.dupes is not None:
+                    self.dupes.add(key, '\n'.join(p['text'] for p in entry['passages']))
+                read_s += t1 - t0
+                vec_s += t2 - t1
+                dupe_s += time.perf_counter() - t2
+                self._entries[key] = entry
+                self._stale = True
+                self.version += 1
+            elif entry['name'] != name or entry['category'] != category:
+                entry['name'] = name
+                entry['category'] = category
+                self.version += 1
+            entry['description'] = item.get('description', '')
+            seen.add(key)
+            current.append(entry)
+
+        for key in [k for k in self._entries if k not in seen]:
+            self._discard(self._entries.pop(key))
+            self._stale = True
+            self.version += 1
+        _add_stage('stat', stat_s * 1000)
+        _add_stage('read', read_s * 1000)
+        _add_stage('vectorize', vec_s * 1000)
+        _add_stage('minhash', dupe_s * 1000)
+        return current
+
+    # Scores at or below this never select a file; reasons are labelled with score_label
+    threshold = 0.02
+    score_label = 'similarity'
+
+    def _refresh(self):
+        if self._stale:
+            with _stage('rebuild'):
+                self._rebuild()
+            self._stale = False
+
+    def score(self, prompt: str, entries: list) -> list:
+        """
+        Cosine similarity of prompt against every passage of each entry (entries
+        must come from sync()). Returns one sequence of passage scores per entry.
+        """
+        if not entries:
+            return []
+        self._refresh()
+        with _stage('score'):
+            return self._score(prompt, entries)
+
+    def search(self, prompt: str, files: int, per_file: int) -> list:
+        """
+        Best passages for prompt as (score, entry, passage index) hits. Covers at
+        least the top `files` files with up to `per_file` passages each where the
+        backend can do so exactly; ordering is left to the caller.
+        """
+        if not self._entries:
+            return []
+        self._refresh()
+        with _stage('score'):
+            return self._search(prompt, files, per_file)
+
+    def _search(self, prompt: str, files: int, per_file: int) -> list:
+        # Dense backends score every passage, so the per-file top-k is exact
+        entries = list(self._entries.values())
+        scores = self._score(prompt, entries)
+        best = [max(s) if len(s) else 0.0 for s in scores]
+        hits = []
+        for i in heapq.nlargest(files, range(len(entries)), key=best.__getitem__):
+            s = scores[i]
+            for j in heapq.nlargest(per_file, range(len(s)), key=s.__getitem__):
+                hits.append((float(s[j]), entries[i], j))
+        return hits
+
+    def _add(self, entry: dict, texts: list):
+        """Index texts (one per passage); sets entry['vec_bytes'] to the bytes this took."""
+        raise NotImplementedError
+
+    def _remove(self, entry: dict):
+        raise NotImplementedError
+
+    def _rebuild(self):
+        raise NotImplementedError
+
+    def _score(self, prompt: str, entries: list) -> list:
+        raise NotImplementedError
+
+
+class _SparseDocIndex(_DocIndex):
+    """
+    Hashed (1,2)-gram sublinear TF rows (one per passage) stacked into one matrix.
+    Document frequencies are maintained incrementally; IDF weighting and row
+    norms are folded in at query time so unchanged rows never need re-vectorizing.
+    """
+
+    def __init__(self):
+        if not _load_retrieval():
+            raise ValueError('tfidf backend needs numpy, scipy and scikit-learn')
+        super().__init__()
+        self._df = np.zeros(N_FEATURES_B, dtype=np.int32)
+        self._n_rows = 0
+        self._matrix = None
+        self._idf = None
+        self._norms = None
+
+    def _vectorize(self, texts: list):
+        X = _hasher.transform(texts).tocsr()
+        X.data = 1.0 + np.log(X.data)
+        return X
+
+    def _vectorize_query(self, prompt: str):
+        if not isinstance(prompt, _Prompt):
+            return self._vectorize([prompt])
+        X = _gram_hasher.transform([prompt.ngrams(*_hasher.ngram_range)]).tocsr()
+        X.data = 1.0 + np.log(X.data)
+        return X
+
+    def _add(self, entry, texts):
+        X = self._vectorize(texts)
+        entry['vec'] = X
+        entry['vec_bytes'] = _csr_bytes(X)
+        # Count each term once per passage
+        np.add.at(self._df, X.indices, 1)
+        self._n_rows += X.shape[0]
+
+    def _remove(self, entry):
+        np.subtract.at(self._df, entry['vec'].indices, 1)
+        self._n_rows -= entry['vec'].shape[0]
+
+    def _rebuild(self):
+        entries = list(self._entries.values())
+        row = 0
+        for entry in entries:
+            entry['rows'] = (row, row + entry['vec'].shape[0])
+            row = entry['rows'][1]
+        self._idf = np.log((1 + self._n_rows) / (1 + self._df)) + 1
+        if entries:
+            # CSC so a query only touches the columns of its own terms
+            self._matrix = sparse.vstack([e['vec'] for e in entries], format='csc')
+            self._norms = np.sqrt(self._matrix.power(2) @ (self._idf ** 2))
+        else:
+            self._matrix = None
+            self._norms = None
+
+    def _index_bytes(self):
+        shared = [self._df, self._idf, self._norms]
+        total = sum(a.nbytes for a in shared if a is not None)
+        return total + (_csr_bytes(self._matrix) if self._matrix is not None else 0)
+
+    def _score(self, prompt, entries):
+        q = self._vectorize_query(prompt)
+        cols = q.indices
+        w = q.data * self._idf[cols]
+        q_norm = np.sqrt(w @ w)
+        if q_norm == 0:
+            return [np.zeros(e['vec'].shape[0]) for e in entries]
+        # Query side already carries one idf factor; the second weights the doc rows
+        dots = self._matrix[:, cols] @ (w * self._idf[cols] / q_norm)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sims = np.where(self._norms > 0, dots / self._norms, 0.0)
+        return [sims[e['rows'][0]:e['rows'][1]] for e in entries]
+
+
+class _PureDocIndex(_DocIndex):
+    """Fallback when numpy/scipy/sklearn are unavailable: cached token counts per passage."""
+
+    def __init__(self):
+        super().__init__()
+        self._df = Counter()
+        self._n_rows = 0
+        self._idf = {}
+
+    def _add(self, entry, texts):
+        entry['vec'] = []
+        for text in texts:
+            tokens = text.lower().split()
+            tf = Counter(tokens)
+            entry['vec'].append({'tf': tf, 'len': len(tokens) or 1})
+            self._df.update(tf.keys())
+        self._n_rows += len(texts)
+        # tf plus the idf-weighted copy _rebuild() adds
+        entry['vec_bytes'] = 2 * _DICT_ITEM_BYTES * sum(len(p['tf']) for p in entry['vec'])
+
+    def _remove(self, entry):
+        for p in entry['vec']:
+            self._df.subtract(p['tf'].keys())
+        self._n_rows -= len(entry['vec'])
+
+    def _index_bytes(self):
+        return _DICT_ITEM_BYTES * (len(self._df) + len(self._idf))
+
+    def _rebuild(self):
+        self._df += Counter()  # drop zero/negative counts left by _remove
+        n = self._n_rows
+        self._idf = {t: math.log((n + 1) / (cnt + 1)) + 1 for t, cnt in self._df.items()}
+        for entry in self._entries.values():
+            for p in entry['vec']:
+                total = p['len']
+                p['w'] = {t: (cnt / total) * self._idf[t] for t, cnt in p['tf'].items()}
+                p['norm'] = math.sqrt(sum(x * x for x in p['w'].values()))
+
+    def _score(self, prompt, entries):
+        tokens = prompt.lower().split()
+        total = len(tokens) or 1
+        q = {t: (cnt / total) * self._idf.get(t, 0) for t, cnt in Counter(tokens).items()}
+        q_norm = math.sqrt(sum(x * x for x in q.values()))
+        out = []
+        for entry in entries:
+            sims = []
+            for p in entry['vec']:
+                if q_norm == 0 or p['norm'] == 0:
+                    sims.append(0.0)
+                    continue
+                w = p['w']
+                sims.append(sum(x * w.get(t, 0) for t, x in q.items()) / (q_norm * p['norm']))
+            out.append(sims)
+        return out
+
+
+class _BM25Index(_DocIndex):
+    """
+    Inverted index (term -> ascending passage ids + term frequencies) scored with
+    BM25. Passage ids only grow, so adds append to postings and removals are a
+    bisect + delete; nothing is ever re-numbered. Queries use MaxScore: terms are
+    ordered by their score upper bound, and once the top-k heap is full, terms
+    whose bounds cannot lift a passage past the k-th score stop driving candidates
+    and are only probed by binary search. Query cost follows the postings of the
+    query terms and k, not the corpus size.
+    """
+
+    K1 = 1.2
+    B = 0.75
+    # Scores are normalized by the best score the query could reach (sum of idf * (k1 + 1))
+    threshold = 0.1
+    score_label = 'bm25'
+
+    def __init__(self):
+        super().__init__()
+        self._postings = {}   # term -> ([passage ids ascending], [tf])
+        self._rows = {}       # passage id -> (entry, passage index, length)
+        self._next_row = 0
+        self._total_len = 0
+        self._tf_bound = {}   # term -> max tf saturation over its postings; cleared on change
+
+    def _add(self, entry, texts):
+        entry['vec'] = []
+        for j, text in enumerate(texts):
+            tf = Counter(_TOKEN_RE.findall(text.lower()))
+            dl = sum(tf.values())
+            row = self._next_row
+            self._next_row += 1
+            self._rows[row] = (entry, j, dl)
+            self._total_len += dl
+            for term, n in tf.items():
+                ids, tfs = self._postings.setdefault(term, ([], []))
+                ids.append(row)
+                tfs.append(n)
+            entry['vec'].append((row, tuple(tf)))
+        entry['vec_bytes'] = _POSTING_BYTES * sum(len(terms) for _, terms in entry['vec'])
+
+    def _remove(self, entry):
+        for row, terms in entry['vec']:
+            self._total_len -= self._rows.pop(row)[2]
+            for term in terms:
+                ids, tfs = self._postings[term]
+                i = bisect.bisect_left(ids, row)
+                del ids[i], tfs[i]
+                if not ids:
+                    del self._postings[term]
+
+    def _index_bytes(self):
+        return _DICT_ITEM_BYTES * (len(self._rows) + len(self._postings) + len(self._tf_bound))
+
+    def _rebuild(self):
+        self._tf_bound.clear()
+
+    def _norm_len(self, avgdl: float):
+        k1, b = self.K1, self.B
+        rows = self._rows
+        return lambda row: k1 * (1 - b + b * rows[row][2] / avgdl)
+
+    def _bound(self, term: str, norm_len) -> float:
+        bound = self._tf_bound.get(term)
+        if bound is None:
+            ids, tfs = self._postings[term]
+            bound = max(tf / (tf + norm_len(row)) for row, tf in zip(ids, tfs))
+            self._tf_bound[term] = bound
+        return bound
+
+    def _score(self, prompt, entries):
+        # Exhaustive scores, for callers that want every passage (search() does not use this)
+        hits = {(id(e), j): s for s, e, j in self._top_k(prompt, len(self._rows))}
+        return [[hits.get((id(e), j), 0.0) for j in range(len(e['vec']))] for e in entries]
+
+    def _search(self, prompt, files, per_file):
+        # Passage-level top-k; 4x headroom so a few long files can't crowd out the rest
+        return self._top_k(prompt, files * per_file * 4)
+
+    def _top_k(self, prompt: str, k: int) -> list:
+        n = len(self._rows)
+        if n == 0 or k <= 0:
+            return []
+        avgdl = self._total_len / n or 1.0
+        norm_len = self._norm_len(avgdl)
+        k1 = self.K1
+
+        lists = []   # [upper bound, weight, ids, tfs, cursor]
+        best_possible = 0.0
+        tokens = prompt.tokens if isinstance(prompt, _Prompt) else _TOKEN_RE.findall(prompt.lower())
+        for term, qtf in Counter(tokens).items():
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            df = len(postings[0])
+            weight = qtf * math.log(1 + (n - df + 0.5) / (df + 0.5)) * (k1 + 1)
+            best_possible += weight
+            lists.append([weight * self._bound(term, norm_len), weight, postings[0], postings[1], 0])
+        if not lists:
+            return []
+
+        lists.sort(key=lambda l: l[0])
+        prefix = list(itertools.accumulate(l[0] for l in lists))
+        heap = []            # min-heap of (score, passage id)
+        theta = 0.0          # k-th best score so far
+        first_essential = 0  # lists[:first_essential] cannot reach theta on their own
+
+        while True:
+            essential = lists[first_essential:]
+            cand = min((l[2][l[4]] for l in essential if l[4] < len(l[2])), default=None)
+            if cand is None:
+                break
+            nl = norm_len(cand)
+            score = 0.0
+            for l in essential:
+                ids, cur = l[2], l[4]
+                if cur < len(ids) and ids[cur] == cand:
+                    tf = l[3][cur]
+                    score += l[1] * tf / (tf + nl)
+                    l[4] = cur + 1
+            # Probe non-essential lists, largest bound first, while they can still matter
+            for i in range(first_essential - 1, -1, -1):
+                if score + prefix[i] <= theta:
+                    break
+                l = lists[i]
+                ids = l[2]
+                pos = bisect.bisect_left(ids, cand, l[4])
+                l[4] = pos
+                if pos < len(ids) and ids[pos] == cand:
+                    tf = l[3][pos]
+                    score += l[1] * tf / (tf + nl)
+
+            if len(heap) < k:
+                heapq.heappush(heap, (score, cand))
+            elif score > theta:
+                heapq.heapreplace(heap, (score, cand))
+            else:
+                continue
+            if len(heap) == k:
+                theta = heap[0][0]
+                while first_essential < len(lists) and prefix[first_essential] <= theta:
+                    first_essential += 1
+
+        hits = []
+        for score, row in heap:
+            entry, j, _ = self._rows[row]
+            hits.append((score / best_possible, entry, j))
+        return hits
+
+
+class _LSAIndex(_SparseDocIndex):
+    """
+    Latent semantic index: passages are projected through a TruncatedSVD basis
+    fit on the idf-weighted hashed TF matrix, and the unit-length float32 vectors
+    live in an anonymous memory-mapped file so a large corpus sits in the page
+    cache rather than on the heap. A query is one projection plus one mat-vec with
+    argpartition top-k. Added or changed files are folded into the existing basis;
+    the basis is refit once REFIT_FRACTION of the passages have changed since the
+    last fit. Corpora too small to fit a basis fall back to plain TF-IDF scoring.
+    """
+
+    N_COMPONENTS = 128
+    # The basis only spans the highest-df hashed columns (and only df >= 2), which
+    # keeps the components at N_COMPONENTS x MAX_FEATURES (25 MB at the defaults)
+    MAX_FEATURES = 50000
+    REFIT_FRACTION = 0.2
+    threshold = 0.15
+    score_label = 'lsa'
+
+    def __init__(self):
+        if not _load_retrieval():
+            raise ValueError('lsa backend needs numpy, scipy and scikit-learn')
+        super().__init__()
+        self._select = None       # (N_FEATURES_B, n kept columns) selection * fit-time idf
+        self._basis = None        # (n kept columns, k) float32; None = TF-IDF fallback
+        self._vectors = None      # memmap (capacity, k) float32, unit rows
+        self._vector_file = None
+        self._slots = []          # vector row -> (entry, passage index), None if free
+        self._free = []
+        self._pending = []        # entries added since the last projection
+        self._changes = 0         # passages added or removed since the last fit
+
+    def _index_bytes(self):
+        # The passage vectors are memory-mapped (page cache, not heap) and not counted
+        total = super()._index_bytes()
+        if self._basis is not None:
+            total += self._basis.nbytes + _csr_bytes(self._select)
+        return total
+
+    def _add(self, entry, texts):
+        super()._add(entry, texts)
+        entry['slots'] = []
+        self._pending.append(entry)
+        self._changes += len(texts)
+
+    def _remove(self, entry):
+        super()._remove(entry)
+        for slot in entry['slots']:
+            self._slots[slot] = None
+            self._vectors[slot] = 0
+            self._free.append(slot)
+        entry['slots'] = []
+        self._changes += entry['vec'].shape[0]
+
+    def _rebuild(self):
+        pending = [e for e in self._pending if self._entries.get(e['key']) is e]
+        self._pending = []
+        if self._basis is None or self._changes > self.REFIT_FRACTION * self._n_rows:
+            self._refit()
+        else:
+            self._fold_in(pending)
+
+    def _weighted(self, X):
+        from sklearn.preprocessing import normalize
+        # float32 throughout: a float64 operand would upcast (copy) the whole basis per call
+        return normalize((X @ self._select).astype(np.float32))
+
+    def _project(self, X):
+        V = np.asarray(self._weighted(X) @ self._basis, dtype=np.float32)
+        norms = np.linalg.norm(V, axis=1, keepdims=True)
+        np.divide(V, norms, out=V, where=norms > 0)
+        return V
+
+    def _allocate(self, capacity: int):
+        f = tempfile.TemporaryFile(prefix='pepper-lsa-', dir=LSA_DIR)
+        vectors = np.memmap(f, dtype=np.float32, mode='w+', shape=(capacity, self._basis.shape[1]))
+        if self._vectors is not None:
+            vectors[:len(self._slots)] = self._vectors[:len(self._slots)]
+            self._vector_file.close()
+        self._vectors, self._vector_file = vectors, f
+
+    def _take_slot(self) -> int:
+        if self._free:
+            return self._free.pop()
+        if len(self._slots) == self._vectors.shape[0]:
+            self._allocate(2 * len(self._slots))
+        self._slots.append(None)
+        return len(self._slots) - 1
+
+    def _refit(self):
+        entries = list(self._entries.values())
+        self._changes = 0
+        self._basis = None
+        self._slots, self._free = [], []
+        if self._vector_file is not None:
+            self._vector_file.close()
+        self._vectors = self._vector_file = None
+        # Every old row is gone, including for the TF-IDF fallback below, where a
+        # leftover slot would make the next _remove() index an empty table
+        for entry in entries:
+            entry['slots'] = []
+
+        n = self._n_rows
+        cols = np.flatnonzero(self._df >= 2)
+        if len(cols) > self.MAX_FEATURES:
+            cols = np.sort(cols[np.argsort(self._df[cols])[-self.MAX_FEATURES:]])
+        k = min(self.N_COMPONENTS, n - 1, len(cols) - 1)
+        if k < 2:
+            super()._rebuild()
+            return
+
+        from sklearn.decomposition import TruncatedSVD
+        # Folded-in rows and queries reuse the fit-time idf so they stay in the same space
+        idf = np.log((1 + n) / (1 + self._df[cols])) + 1
+        self._select = sparse.csr_matrix(
+            (idf, (cols, np.arange(len(cols)))), shape=(N_FEATURES_B, len(cols)), dtype=np.float32,
+        )
+        X = sparse.vstack([e['vec'] for e in entries], format='csr')
+        svd = TruncatedSVD(n_components=k, algorithm='randomized', n_iter=5, random_state=0)
+        svd.fit(self._weighted(X))
+        # Contiguous (columns, k) so projecting is a straight sparse @ dense
+        self._basis = np.ascontiguousarray(svd.components_.T, dtype=np.float32)
+        # Free the TF-IDF fallback state; the latent vectors replace it
+        self._matrix = self._norms = None
+
+        self._allocate(max(n, 1))
+        self._vectors[:n] = self._project(X)
+        for entry in entries:
+            start = len(self._slots)
+            entry['slots'] = list(range(start, start + entry['vec'].shape[0]))
+            self._slots.extend((entry, j) for j in range(entry['vec'].shape[0]))
+
+    def _fold_in(self, entries: list):
+        for entry in entries:
+            V = self._project(entry['vec'])
+            for j in range(V.shape[0]):
+                slot = self._take_slot()
+                self._vectors[slot] = V[j]
+                self._slots[slot] = (entry, j)
+                entry['slots'].append(slot)
+
+    def _similarities(self, prompt: str):
+        q = self._project(self._vectorize_query(prompt))[0]
+        return self._vectors[:len(self._slots)] @ q
+
+    def _score(self, prompt, entries):
+        if self._basis is None:
+            return super()._score(prompt, entries)
+        sims = self._similarities(prompt)
+        return [sims[e['slots']] for e in entries]
+
+    def _search(self, prompt, files, per_file):
+        if self._basis is None:
+            return _DocIndex._search(self, prompt, files, per_file)
+        sims = self._similarities(prompt)
+        # Passage-level top-k with the same 4x headroom as BM25
+        k = min(files * per_file * 4, len(sims))
+        top = np.argpartition(-sims, k - 1)[:k]
+        hits = []
+        for slot in top:
+            ref = self._slots[slot]
+            if ref is not None:
+                hits.append((float(sims[slot]), ref[0], ref[1]))
+        return hits
+
+
+# ---------------------------------------------------------------------------
+# Phase B backends. Each index is created on first use and guarded by its own
+# lock (sync() renumbers rows, so sync + search must happen under one lock).
+# PEPPER_RETRIEVAL picks the default; a phase_b request may name another.
+# ---------------------------------------------------------------------------
+RETRIEVAL_BACKENDS = {
+    'tfidf': lambda: _SparseDocIndex() if _load_retrieval() else _PureDocIndex(),
+    'tfidf-pure': _PureDocIndex,
+    'bm25': _BM25Index,
+    'lsa': _LSAIndex,
+}
+DEFAULT_RETRIEVAL = os.environ.get('PEPPER_RETRIEVAL', 'tfidf')
+
+_indexes = {}   # backend name -> (index, lock)
+_indexes_lock = threading.Lock()
+
+
+def _get_index(backend: str = None):
+    backend = backend or DEFAULT_RETRIEVAL
+    with _indexes_lock:
+        if backend not in _indexes:
+            factory = RETRIEVAL_BACKENDS.get(backend)
+            if factory is None:
+                raise ValueError(f'unknown retrieval backend: {backend}')
+            _indexes[backend] = (factory(), threading.Lock())
+        index, lock = _indexes[backend]
+        index.last_used = time.monotonic()
+        return index, lock
+
+
+# ---------------------------------------------------------------------------
+# Phase B: passage retrieval
+# ---------------------------------------------------------------------------
+MAX_FILES = 8
+MAX_PASSAGES_PER_FILE = 3
+# A file's other passages come along only if they score within this fraction of its best
+PASSAGE_RELATIVE_CUT = 0.5
+
+
+def run_phase_b(prompt: str, inventory: list, backend: str = None) -> dict:
     if not inventory:
         return {
             'selectedMemories': [],
@@ -105,45 +1633,133 @@ def run_phase_b(prompt: str, inventory: list) -> dict:
             'notes': 'No memory files in inventory',
         }
 
-    # Read file contents for each inventory item
-    docs = []
-    for item in inventory:
-        path = item.get('path', '')
-        try:
-            with open(path, encoding='utf-8', errors='replace') as f:
-                content = f.read()
-        except Exception:
-            content = item.get('description', '')
-        docs.append({
-            'name': item.get('name', ''),
-            'category': item.get('category', 'knowledge'),
-            'description': item.get('description', ''),
-            'content': content,
-        })
-
-    # Build TF-IDF on the corpus (memory file contents) + query
-    corpus = [d['content'] for d in docs]
-    scores = _tfidf_cosine(prompt, corpus)
-
-    # Sort and filter
-    THRESHOLD_B = 0.02
-    MAX_FILES = 8
-
-    ranked = sorted(zip(scores, docs), key=lambda x: x[0], reverse=True)
-    selected = []
-    for score, doc in ranked:
-        if score > THRESHOLD_B and len(selected) < MAX_FILES:
-            selected.append({
-                'name': doc['name'],
-                'category': doc['category'],
-                'reason': f'similarity: {score:.2f}',
-            })
+    backend = backend or DEFAULT_RETRIEVAL
+    index, lock = _get_index(backend)
+    with _stage('lock_wait'):
+        lock.acquire()
+    try:
+        docs = index.sync(inventory)
+        cache_key = (backend, _normalize_prompt(prompt), index.version)
+        cached = _phase_b_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached)
+        # Collapsed duplicates free up slots, so look further down the ranking when there are any
+        files = 2 * MAX_FILES if index.dupes else MAX_FILES
+        hits = index.search(prompt, files, MAX_PASSAGES_PER_FILE)
+        hit_entries = {e['key']: e for _, e, _ in hits}
+        for entry in hit_entries.values():
+            if entry['text_dropped'] and index.restore_text(entry):
+                _budget.restored += 1
+        # Snapshots: another request's sync() may change the duplicate graph, and the
+        # memory budget may drop passage text, once the lock is released
+        twins = {key: set(index.dupes.neighbors(key)) for key in hit_entries} if index.dupes else {}
+        passages_of = {key: e['passages'] for key, e in hit_entries.items()}
+    finally:
+        lock.release()
 
-    return {
+    # A file ranks by its best passage; it brings along its next-best passages.
+    # A near-duplicate of a file already selected is folded into that file's entry.
+    with _stage('rank'):
+        by_file = {}
+        for score, entry, j in sorted(hits, key=lambda h: h[0], reverse=True):
+            by_file.setdefault(entry['key'], (entry, []))[1].append((score, j))
+        selected = []
+        kept = {}
+        collapsed = 0
+        for entry, passage_hits in by_file.values():
+            best = passage_hits[0][0]
+            if best <= index.threshold or len(selected) >= MAX_FILES:
+                break
+            twin = next((kept[k] for k in twins.get(entry['key'], ()) if k in kept), None)
+            if twin is not None:
+                twin.setdefault('duplicates', []).append(entry['name'])
+                collapsed += 1
+                continue
+            floor = max(index.threshold, best * PASSAGE_RELATIVE_CUT)
+            passages = []
+            entry['used'] = next(_use_clock)
+            for score, j in passage_hits[:MAX_PASSAGES_PER_FILE]:
+                if score < floor:
+                    break
+                p = passages_of[entry['key']][j]
+                passages.append({
+                    'heading': p['heading'],
+                    'text': p['text'] or '',
+                    'lines': [p['start'], p['end']],
+                    'score': round(score, 3),
+                })
+            kept[entry['key']] = {
+                'name': entry['name'],
+                'category': entry['category'],
+                'reason': f'{index.score_label}: {best:.2f}',
+                'passages': passages,
+            }
+            selected.append(kept[entry['key']])
+
+    result = {
         'selectedMemories': selected,
         'missingMemories': [],
         'toolsNeeded': [],
-        'notes': f'Selected by TF-IDF cosine similarity from {len(docs)} memory files (threshold {THRESHOLD_B}, top {MAX_FILES})',
+        'notes': (
+            f'Selected by {backend} over passages from {len(docs)} memory files '
+            f'(threshold {index.threshold}, top {MAX_FILES} files, {MAX_PASSAGES_PER_FILE} passages each)'
+            + (f'; {collapsed} near-duplicate files collapsed' if collapsed else '')
+        ),
+    }
+    _phase_b_cache.put(cache_key, result)
+    _budget.enforce(keep=backend)
+    return dict(result)
+
+
+def run_dedupe(inventory: list, backend: str = None) -> dict:
+    """
+    Near-duplicate clusters among the memory files in inventory. Uses (and syncs)
+    the same index as phase_b, so only new or changed files are re-hashed.
+    """
+    backend = backend or DEFAULT_RETRIEVAL
+    index, lock = _get_index(backend)
+    if index.dupes is None:
+        return {'error': 'near-duplicate detection needs numpy'}
+    with _stage('lock_wait'):
+        lock.acquire()
+    try:
+        docs = index.sync(inventory)
+        with _stage('cluster'):
+            clusters = index.dupes.clusters()
+        entries = {e['key']: e for e in docs}
+    finally:
+        lock.release()
+    _budget.enforce(keep=backend)
+
+    def describe(key):
+        entry = entries[key]
+        # Keys are paths, except for inventory items that had none
+        path = None if key.startswith('\0') else key
+        return {'name': entry['name'], 'category': entry['category'], 'path': path}
+
+    return {
+        'clusters': [
+            {'files': [describe(k) for k in keys], 'similarity': round(lowest, 3)}
+            for keys, lowest in clusters
+        ],
+        'files': len(docs),
+        # Files that could go while keeping one per cluster
+        'redundant': sum(len(keys) - 1 for keys, _ in clusters),
+        'threshold': index.dupes.threshold,
+    }
+
+
+def run_phase_ab(prompt: str, inventory: list, backend: str = None) -> dict:
+    """
+    Phase A and Phase B for one prompt in one request. The prompt is normalized,
+    tokenized and split into n-grams once and shared by the classifier and the
+    retrieval index; each half returns exactly what its own task would.
+    """
+    with _stage('preprocess'):
+        prompt = _Prompt(prompt)
+    return {
+        'phase_a': run_phase_a(prompt),
+        'phase_b': run_phase_b(prompt, inventory, backend),
     }
 
 
@@ -151,6 +1767,7 @@ def _tfidf_cosine(query: str, docs: list) -> list:
     """
     Compute TF-IDF cosine similarity between query and each doc.
     Uses sklearn if available (fast), falls back to pure-Python implementation.
+    Stateless one-shot scoring over raw text; run_phase_b uses the cached indexes.
     """
     try:
         from sklearn.feature_extraction.text import TfidfVectorizer
@@ -170,9 +1787,6 @@ def _tfidf_cosine(query: str, docs: list) -> list:
 
 def _tfidf_cosine_pure(query: str, docs: list) -> list:
     """Fallback: pure-Python TF-IDF cosine similarity."""
-    import math
-    from collections import Counter
-
     def tokenize(text):
         return text.lower().split()
 
@@ -204,31 +1818,737 @@ def _tfidf_cosine_pure(query: str, docs: list) -> list:
     return [cosine(query_vec, tfidf_vec(tokens)) for tokens in token_lists[1:]]
 
 
+# ---------------------------------------------------------------------------
+# Memory budget. PEPPER_INFER_MEMORY_MB caps the approximate bytes this process
+# holds in passage text, index vectors and cached Phase B results (0 = no cap;
+# each pool worker has its own). Over budget, the coldest things go first:
+# cached results (LRU), then whole indexes of non-default backends no request has
+# used for longest (never the one the current request is using), then the raw
+# text of the files selected least recently. That text is re-read from disk if the
+# file is selected again; vectors of the indexes still in use are never dropped,
+# so retrieval quality does not change. Those vectors (and the fixed-size df/idf
+# arrays of the hashed backends) are a floor the budget cannot go below; when the
+# floor alone exceeds it, nothing is evicted, since flushing the caches could not
+# reach the target and would only make every request rebuild them.
+# ---------------------------------------------------------------------------
+MEMORY_BUDGET_MB = float(os.environ.get('PEPPER_INFER_MEMORY_MB', '0'))
+
+# Ticks on every Phase B selection; entry['used'] orders text eviction
+_use_clock = itertools.count(1)
+
+
+def _result_bytes(result: dict) -> int:
+    size = sys.getsizeof(result) + sys.getsizeof(result.get('notes', ''))
+    for item in result.get('selectedMemories', ()):
+        size += sys.getsizeof(item) + sum(
+            sys.getsizeof(p) + sys.getsizeof(p['text']) + sys.getsizeof(p['heading'])
+            for p in item['passages']
+        )
+    return size
+
+
+class _MemoryBudget:
+    def __init__(self, limit_mb: float):
+        self.limit = int(limit_mb * 2 ** 20)
+        self.evicted = {'results': 0, 'indexes': 0, 'texts': 0}
+        self.restored = 0
+        self.floor = 0           # bytes eviction cannot free, as of the last over-budget check
+        self._warned = False
+        self._lock = threading.Lock()
+
+    def usage(self) -> dict:
+        with _indexes_lock:
+            indexes = [index for index, _ in _indexes.values()]
+        usage = {'text': 0, 'vectors': 0, 'results': _phase_b_cache.bytes}
+        for index in indexes:
+            for kind, n in index.memory_usage().items():
+                usage[kind] += n
+        return usage
+
+    def _over(self) -> int:
+        return sum(self.usage().values()) - self.limit
+
+    def _floor(self, keep: str) -> int:
+        """Bytes left if everything evictable went: the vectors of the indexes kept, and text that cannot be re-read."""
+        with _indexes_lock:
+            kept = [index for name, (index, _) in _indexes.items() if name in (DEFAULT_RETRIEVAL, keep)]
+        floor = 0
+        for index in kept:
+            floor += index.memory_usage()['vectors']
+            floor += sum(e['text_bytes'] for e in list(index._entries.values()) if e['key'].startswith('\0'))
+        return floor
+
+    def enforce(self, keep: str = None):
+        """
+        Evict until under budget, sparing the index of backend `keep` (the caller's).
+        Cheap when under; concurrent callers leave it to the first.
+        """
+        if self.limit <= 0 or not self._lock.acquire(blocking=False):
+            return
+        try:
+            if self._over() <= 0:
+                return
+            self.floor = self._floor(keep)
+            if self.floor > self.limit:
+                if not self._warned:
+                    self._warned = True
+                    _log(f'memory budget: {_mb(self.limit)} MB is below the {_mb(self.floor)} MB the '
+                         f'loaded indexes need; not evicting (raise PEPPER_INFER_MEMORY_MB)')
+                return
+            with _stage('evict'):
+                self._evict(keep)
+        finally:
+            self._lock.release()
+
+    def _evict(self, keep: str = None):
+        while self._over() > 0 and _phase_b_cache.evict_oldest():
+            self.evicted['results'] += 1
+
+        with _indexes_lock:
+            cold = sorted(
+                (index.last_used, name) for name, (index, _) in _indexes.items()
+                if name not in (DEFAULT_RETRIEVAL, keep)
+            )
+        for _, name in cold:
+            if self._over() <= 0:
+                return
+            with _indexes_lock:
+                # In-flight requests keep their reference; the next one rebuilds it
+                _indexes.pop(name, None)
+            self.evicted['indexes'] += 1
+            _log(f'memory budget: evicted the {name} index')
+
+        over = self._over()
+        with _indexes_lock:
+            live = list(_indexes.values())
+        for index, lock in live:
+            if over <= 0:
+                return
+            with lock:
+                for entry in sorted(index._entries.values(), key=lambda e: e.get('used', 0)):
+                    if over <= 0:
+                        break
+                    freed = index.drop_text(entry)
+                    if freed:
+                        over -= freed
+                        self.evicted['texts'] += 1
+
+    def snapshot(self) -> dict:
+        usage = self.usage()
+        return {
+            'budget_mb': _mb(self.limit) if self.limit > 0 else None,
+            'used_mb': _mb(sum(usage.values())),
+            'floor_mb': _mb(self.floor),
+            **{f'{kind}_mb': _mb(n) for kind, n in usage.items()},
+            'evicted': dict(self.evicted),
+            'texts_restored': self.restored,
+        }
+
+
+_budget = _MemoryBudget(MEMORY_BUDGET_MB)
+
+
+# ---------------------------------------------------------------------------
+# Process stats (the `stats` task)
+# ---------------------------------------------------------------------------
+LATENCY_BUCKETS_MS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+KNOWN_TASKS = ('phase_a', 'phase_a_batch', 'phase_b', 'phase_ab', 'dedupe', 'route', 'stats', 'reload')
+
+
+class _Stats:
+    """Per-task request counters and fixed-bucket latency histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tasks = {}
+
+    def record(self, task: str, ms: float, error: bool):
+        with self._lock:
+            t = self._tasks.setdefault(task, {
+                'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'buckets': [0] * (len(LATENCY_BUCKETS_MS) + 1),
+            })
+            t['count'] += 1
+            t['errors'] += int(error)
+            t['total_ms'] += ms
+            t['max_ms'] = max(t['max_ms'], ms)
+            t['buckets'][next((i for i, b in enumerate(LATENCY_BUCKETS_MS) if ms <= b), -1)] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            tasks = {}
+            for name, t in self._tasks.items():
+                labels = [f'le_{b}' for b in LATENCY_BUCKETS_MS] + ['le_inf']
+                tasks[name] = {
+                    'count': t['count'],
+                    'errors': t['errors'],
+                    'mean_ms': round(t['total_ms'] / t['count'], 3) if t['count'] else 0.0,
+                    'max_ms': round(t['max_ms'], 3),
+                    'histogram_ms': dict(zip(labels, t['buckets'])),
+                }
+        return tasks
+
+
+_stats = _Stats()
+
+
+def _rss_mb():
+    """(current, peak) resident set size in MB; either may be None on platforms without /proc or resource."""
+    current = peak = None
+    try:
+        with open('/proc/self/statm') as f:
+            current = round(int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20, 1)
+    except Exception:
+        pass
+    try:
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        peak = round(maxrss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)
+    except Exception:
+        pass
+    return current, peak
+
+
+def _index_stats() -> dict:
+    with _indexes_lock:
+        indexes = dict(_indexes)
+    return {
+        name: {
+            'class': type(index).__name__,
+            'documents': len(index),
+            'passages': index.passage_count(),
+            'version': index.version,
+            'text_mb': _mb(index.text_bytes),
+            'vectors_mb': _mb(index.memory_usage()['vectors']),
+            'texts_dropped': index.texts_dropped,
+            'near_duplicate_files': len(index.dupes) if index.dupes is not None else None,
+            'minhash_comparisons': index.dupes.comparisons if index.dupes is not None else None,
+        }
+        for name, (index, _) in indexes.items()
+    }
+
+
+def run_stats() -> dict:
+    tasks = _stats.snapshot()
+    rss, peak_rss = _rss_mb()
+    return {
+        'pid': os.getpid(),
+        'uptime_s': round(time.perf_counter() - _T_START, 1),
+        'workers': WORKERS,
+        'procs': PROCS,
+        'index_replicas': INDEX_REPLICAS,
+        'clients': _clients,
+        'model': _model_info(_model),
+        'model_reload': dict(_reload_state, watch_s=MODEL_WATCH_S),
+        'route_model': _route_model is not None,
+        'retrieval': DEFAULT_RETRIEVAL,
+        'indexes': _index_stats(),
+        'cache': {'phase_a': _phase_a_cache.stats(), 'phase_b': _phase_b_cache.stats()},
+        'memory': _budget.snapshot(),
+        'tasks': tasks,
+        'errors': sum(t['errors'] for t in tasks.values()),
+        'rss_mb': rss,
+        'peak_rss_mb': peak_rss,
+        'load_timings': dict(_LOAD_TIMINGS),
+        **({'pool': _pool.snapshot()} if _pool is not None else {}),
+    }
+
+
 # ---------------------------------------------------------------------------
 # Main loop
 # ---------------------------------------------------------------------------
-def main():
-    sys.stderr.write('[infer.py] Ready\n')
-    sys.stderr.flush()
+_stdout_lock = threading.Lock()
 
-    for line in sys.stdin:
-        line = line.strip()
-        if not line:
-            continue
+
+def _dispatch(req: dict) -> dict:
+    task = req.get('task')
+    if task == 'phase_a':
+        return run_phase_a(req.get('prompt', ''))
+    if task == 'phase_a_batch':
+        return run_phase_a_batch(req.get('prompts', []))
+    if task == 'phase_b':
+        return run_phase_b(req.get('prompt', ''), req.get('inventory', []), req.get('backend'))
+    if task == 'phase_ab':
+        return run_phase_ab(req.get('prompt', ''), req.get('inventory', []), req.get('backend'))
+    if task == 'dedupe':
+        return run_dedupe(req.get('inventory', []), req.get('backend'))
+    if task == 'route':
+        return run_route(req.get('prompt', ''))
+    if task == 'stats':
+        return run_stats()
+    if task == 'reload':
+        result = reload_model(bool(req.get('force')))
+        if _pool is not None:
+            result['workers'] = _pool.broadcast(req)
+        return result
+    return {'error': f'unknown task: {task}'}
+
+
+def handle_request(req: dict) -> dict:
+    task = req.get('task')
+    stages = _tls.stages = {} if req.get('timing') else None
+    t = time.perf_counter()
+    try:
+        result = _dispatch(req)
+    except Exception as e:
+        result = {'error': str(e)}
+    finally:
+        _tls.stages = None
+    total_ms = (time.perf_counter() - t) * 1000
+
+    _stats.record(task if task in KNOWN_TASKS else 'unknown', total_ms, 'error' in result)
+    if stages is not None:
+        timing = {f'{name}_ms': round(ms, 3) for name, ms in stages.items()}
+        result['_timing'] = {'total_ms': round(total_ms, 3), **timing}
+    return result
+
+
+def _write_stdout(message: dict):
+    line = json.dumps(message) + '\n'
+    with _stdout_lock:
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+
+def _respond(result: dict, req_id=None, write=None):
+    """Send one reply: to the parent in a pool worker, else to write (a daemon client) or stdout."""
+    if req_id is not None:
+        result = dict(result, id=req_id)
+    if _sink is not None:
+        with _stdout_lock:
+            _sink.send(result)
+        return
+    (write or _write_stdout)(result)
+
+
+def _serve(req: dict, write=None):
+    _respond(handle_request(req), req.get('id'), write)
+
+
+def _accept(line: str, executor, write=None):
+    """Parse one request line and answer it inline (no id) or asynchronously (with an id)."""
+    line = line.strip()
+    if not line:
+        return
+    try:
+        req = json.loads(line)
+        if not isinstance(req, dict):
+            raise ValueError('request must be a JSON object')
+    except Exception as e:
+        _respond({'error': str(e)}, write=write)
+        return
+
+    if req.get('id') is None:
+        _serve(req, write)
+    elif _pool is not None and req.get('task') not in ('stats', 'reload'):
+        _pool.forward(req, write)
+    else:
+        executor.submit(_serve, req, write)
+
+
+def prewarm() -> dict:
+    """
+    Run one throwaway inference through every hot path so first-call costs
+    (lazy imports inside numpy/scipy, regex compilation, allocator growth) are
+    paid before the first real request. Returns the ready message.
+    """
+    t = time.perf_counter()
+    run_phase_a('warm up the classifier')
+    run_phase_a_batch(['open the browser', 'make slides about the roadmap'])
+    run_route('warm up the router')
+    scratch = RETRIEVAL_BACKENDS[DEFAULT_RETRIEVAL]()  # keep the real index untouched
+    scratch.sync([{'name': 'warmup', 'category': 'knowledge', 'description': 'warm up the retrieval index'}])
+    scratch.search('warm up retrieval', MAX_FILES, MAX_PASSAGES_PER_FILE)
+    _LOAD_TIMINGS['warmup_ms'] = _ms_since(t)
+    _LOAD_TIMINGS['total_ms'] = _ms_since(_T_START)
+    return {
+        'event': 'ready',
+        'pid': os.getpid(),
+        'model': type(_model).__name__ if _model is not None else None,
+        'model_version': getattr(_model, 'version', None),
+        'retrieval': DEFAULT_RETRIEVAL,
+        'timings': dict(_LOAD_TIMINGS),
+    }
+
+# ---------------------------------------------------------------------------
+# Pre-forked worker pool (PEPPER_INFER_PROCS > 1, or "auto" for one per core).
+# The parent loads the model and warms up, then forks workers that share those
+# pages copy-on-write (gc.freeze() keeps the collector from dirtying them).
+# Requests with an id go to the least-loaded worker, except retrieval (phase_b,
+# phase_ab, dedupe), which goes to the least-loaded of its backend's
+# INDEX_REPLICAS workers. Each of those builds and holds its own passage index
+# (the parent never sees an inventory before forking, so there is nothing to
+# share copy-on-write); the default of one replica keeps a single index per
+# backend at the cost of retrieval not scaling past one process.
+# Requests without an id are still answered inline by the parent, in order.
+# stats and reload fan out to every worker. A worker that dies fails its
+# in-flight requests with an error and is forked again.
+# ---------------------------------------------------------------------------
+def _procs_setting() -> int:
+    value = os.environ.get('PEPPER_INFER_PROCS', '1')
+    procs = (os.cpu_count() or 1) if value == 'auto' else max(1, int(value))
+    if procs > 1 and not hasattr(os, 'fork'):
+        # Windows: no fork, so no shared-model workers; serve in-process as with PROCS=1
+        _log(f'PEPPER_INFER_PROCS={value} needs os.fork, which this platform lacks; using one process')
+        return 1
+    return procs
+
+
+def _replicas_setting() -> int:
+    value = os.environ.get('PEPPER_INFER_INDEX_REPLICAS', '1')
+    return PROCS if value == 'all' else min(PROCS, max(1, int(value)))
+
+
+PROCS = _procs_setting()
+INDEX_REPLICAS = _replicas_setting()
+BROADCAST_TIMEOUT_S = 5.0
+
+_pool = None   # parent side: the _WorkerPool when PROCS > 1
+_sink = None   # worker side: replies go to the parent over this Connection instead of stdout
+
+
+def _after_fork_in_child():
+    # Locks held by another parent thread at fork time would stay locked forever here
+    global _stdout_lock, _indexes_lock, _reload_lock, _retrieval_lock, _clients_lock, _pool
+    _stdout_lock = threading.Lock()
+    _indexes_lock = threading.Lock()
+    _reload_lock = threading.Lock()
+    _retrieval_lock = threading.Lock()
+    _clients_lock = threading.Lock()
+    _stats._lock = threading.Lock()
+    _phase_a_cache._lock = threading.Lock()
+    _phase_b_cache._lock = threading.Lock()
+    _budget._lock = threading.Lock()
+    for name, (index, lock) in list(_indexes.items()):
+        if lock.locked():
+            del _indexes[name]  # caught mid-sync; rebuilt on first use
+        else:
+            _indexes[name] = (index, threading.Lock())
+    _pool = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _worker_main(conn, inherited: list):
+    """Worker process: serve requests from the parent's pipe until it closes."""
+    global _sink
+    # Drop copies of the parent's pipe ends, or EOF would never arrive when the parent exits
+    for c in inherited:
+        c.close()
+    _sink = conn
+    if MODEL_WATCH_S > 0:
+        threading.Thread(target=_watch_model, name='model-watch', daemon=True).start()
+    pool = ThreadPoolExecutor(max_workers=max(1, WORKERS), thread_name_prefix='infer')
+    while True:
         try:
-            req = json.loads(line)
-            task = req.get('task')
-            if task == 'phase_a':
-                result = run_phase_a(req.get('prompt', ''))
-            elif task == 'phase_b':
-                result = run_phase_b(req.get('prompt', ''), req.get('inventory', []))
-            else:
-                result = {'error': f'unknown task: {task}'}
+            req = conn.recv()
+        except (EOFError, OSError):
+            break
+        if req is None:  # shutdown sentinel from _WorkerPool.close()
+            break
+        pool.submit(_serve, req)
+    pool.shutdown(wait=True)
+
+
+class _Worker:
+    def __init__(self, slot: int):
+        self.slot = slot
+        self.pid = None
+        self.alive = False
+        self.conn = None
+        self.pending = {}                 # internal id -> Future
+        self.lock = threading.Lock()      # guards pending and counters
+        self.send_lock = threading.Lock()
+        self.submitted = self.completed = self.errors = self.restarts = 0
+        self.started_at = None
+
+
+class _WorkerPool:
+    def __init__(self, n: int):
+        self._ids = itertools.count()
+        self._fork_lock = threading.Lock()
+        self._closing = False
+        self.workers = [_Worker(i) for i in range(n)]
+        for worker in self.workers:
+            self._start(worker)
+
+    def _start(self, worker: _Worker):
+        with self._fork_lock:
+            parent_conn, child_conn = multiprocessing.Pipe()
+            inherited = [w.conn for w in self.workers if w.conn is not None and w is not worker]
+            gc.freeze()
+            # Plain fork rather than multiprocessing.Process: its child bootstrap closes
+            # sys.stdin, which deadlocks when the parent's main thread is blocked reading it
+            pid = os.fork()
+            if pid == 0:
+                code = 0
+                try:
+                    _worker_main(child_conn, inherited + [parent_conn])
+                except BaseException as e:
+                    _log(f'Worker {worker.slot} crashed: {e!r}')
+                    code = 1
+                finally:
+                    os._exit(code)
+            child_conn.close()
+            worker.pid, worker.alive, worker.conn, worker.started_at = pid, True, parent_conn, time.time()
+        threading.Thread(
+            target=self._read, args=(worker, pid, parent_conn),
+            name=f'infer-worker-{worker.slot}-reader', daemon=True,
+        ).start()
+
+    def _read(self, worker: _Worker, pid: int, conn):
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                break
+            with worker.lock:
+                fut = worker.pending.pop(msg.pop('id', None), None)
+                worker.completed += 1
+                worker.errors += int('error' in msg)
+            if fut is not None:
+                fut.set_result(msg)
+
+        _, status = os.waitpid(pid, 0)
+        code = os.waitstatus_to_exitcode(status)
+        conn.close()
+        with worker.lock:
+            worker.alive = False
+            lost, worker.pending = worker.pending, {}
+        for fut in lost.values():
+            fut.set_result({'error': f'inference worker exited (code {code})'})
+        if self._closing:
+            return
+        _log(f'Worker {worker.slot} (pid {pid}) exited with code {code}; '
+             f'restarting ({len(lost)} in-flight requests failed)')
+        worker.restarts += 1
+        self._start(worker)
+
+    def _pick(self, req: dict) -> _Worker:
+        # Retrieval goes to one of the workers whose index for its backend is already warm
+        candidates = self.workers
+        if req.get('task') in ('phase_b', 'phase_ab', 'dedupe'):
+            backend = req.get('backend') or DEFAULT_RETRIEVAL
+            first = zlib.crc32(backend.encode())
+            candidates = [self.workers[(first + i) % len(self.workers)] for i in range(INDEX_REPLICAS)]
+        return min(candidates, key=lambda w: (len(w.pending), w.submitted))
+
+    def submit(self, req: dict, worker: _Worker = None) -> Future:
+        """Send req to a worker; the Future resolves with its result dict (an error dict if the worker dies)."""
+        worker = worker or self._pick(req)
+        fut = Future()
+        rid = next(self._ids)
+        with worker.lock:
+            worker.pending[rid] = fut
+            worker.submitted += 1
+        try:
+            with worker.send_lock:
+                worker.conn.send(dict(req, id=rid))
         except Exception as e:
-            result = {'error': str(e)}
+            with worker.lock:
+                lost = worker.pending.pop(rid, None)
+            if lost is not None:
+                lost.set_result({'error': f'inference worker unavailable: {e}'})
+        return fut
 
-        sys.stdout.write(json.dumps(result) + '\n')
-        sys.stdout.flush()
+    def forward(self, req: dict, write=None):
+        """Run a client request on a worker and send the reply to the client under its own id."""
+        t = time.perf_counter()
+        task = req.get('task')
+
+        def done(fut):
+            result = fut.result()
+            _stats.record(task if task in KNOWN_TASKS else 'unknown', (time.perf_counter() - t) * 1000, 'error' in result)
+            _respond(result, req.get('id'), write)
+
+        self.submit(req).add_done_callback(done)
+
+    def broadcast(self, req: dict) -> list:
+        futures = [self.submit(req, w) for w in self.workers]
+        results = []
+        for fut in futures:
+            try:
+                results.append(fut.result(BROADCAST_TIMEOUT_S))
+            except FutureTimeout:
+                results.append({'error': f'no reply within {BROADCAST_TIMEOUT_S}s'})
+        return results
+
+    def snapshot(self) -> list:
+        """Per-worker load as seen by the parent, merged with each worker's own stats."""
+        replies = self.broadcast({'task': 'stats'})
+        out = []
+        for worker, reply in zip(self.workers, replies):
+            with worker.lock:
+                load = {
+                    'slot': worker.slot,
+                    'pid': worker.pid,
+                    'alive': worker.alive,
+                    'in_flight': len(worker.pending),
+                    'submitted': worker.submitted,
+                    'completed': worker.completed,
+                    'errors': worker.errors,
+                    'restarts': worker.restarts,
+                    'up_s': round(time.time() - worker.started_at, 1) if worker.started_at else None,
+                }
+            if 'error' in reply:
+                load['error'] = reply['error']
+            else:
+                for key in ('tasks', 'rss_mb', 'peak_rss_mb', 'cache', 'indexes'):
+                    load[key] = reply.get(key)
+                load['model_version'] = (reply.get('model') or {}).get('version')
+            out.append(load)
+        return out
+
+    def close(self, timeout: float = 10.0):
+        """Wait for in-flight requests, then let the workers exit."""
+        deadline = time.time() + timeout
+        while any(w.pending for w in self.workers) and time.time() < deadline:
+            time.sleep(0.01)
+        self._closing = True
+        # A sentinel rather than closing our end: the reader thread blocked in recv()
+        # keeps the socket open, so the worker would never see EOF
+        for worker in self.workers:
+            try:
+                with worker.send_lock:
+                    worker.conn.send(None)
+            except Exception:
+                pass
+        while any(w.alive for w in self.workers) and time.time() < deadline:
+            time.sleep(0.01)
+
+
+# ---------------------------------------------------------------------------
+# Daemon mode: `python infer.py --daemon [--socket PATH]` serves the same
+# protocol on a Unix domain socket so every Node process on the host shares one
+# warm model and index. Each connection gets the ready message first, then
+# request lines; replies go back on the connection that asked. Requests with an
+# id share the worker pool; requests without one are answered in order per
+# connection.
+# ---------------------------------------------------------------------------
+def _socket_path_setting() -> str:
+    # Same default as ml-runner.js; os.getuid does not exist on Windows
+    getuid = getattr(os, 'getuid', None)
+    return os.environ.get('PEPPER_INFER_SOCKET') or os.path.join(
+        tempfile.gettempdir(), f'pepper-infer-{getuid() if getuid else 0}.sock',
+    )
+
+_clients = 0
+_clients_lock = threading.Lock()
+
+
+def _claim_socket(path: str) -> bool:
+    """Remove a stale socket file; False if a live daemon already answers on path."""
+    if not os.path.exists(path):
+        return True
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return False
+    except OSError:
+        os.unlink(path)
+        return True
+    finally:
+        probe.close()
+
+
+def _serve_connection(conn, ready: dict, executor):
+    global _clients
+    lock = threading.Lock()
+
+    def write(message: dict):
+        data = (json.dumps(message) + '\n').encode()
+        with lock:
+            try:
+                conn.sendall(data)
+            except OSError:
+                pass  # client went away; its remaining replies are dropped
+
+    with _clients_lock:
+        _clients += 1
+    try:
+        write(ready)
+        with conn.makefile('r', encoding='utf-8') as lines:
+            for line in lines:
+                _accept(line, executor, write)
+    except OSError:
+        pass
+    finally:
+        with _clients_lock:
+            _clients -= 1
+        conn.close()
+
+
+def serve_daemon(path: str, ready: dict, executor):
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Owner-only from the moment the socket file exists (a chmod after bind leaves a window)
+    old_umask = os.umask(0o177)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(old_umask)
+    server.listen(64)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    _log(f'Daemon listening on {path}')
+    try:
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(
+                target=_serve_connection, args=(conn, ready, executor), name='infer-client', daemon=True,
+            ).start()
+    finally:
+        server.close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def main():
+    global _pool
+    args = sys.argv[1:]
+    daemon = '--daemon' in args
+    if daemon and not hasattr(socket, 'AF_UNIX'):
+        _log('--daemon needs Unix domain sockets, which this platform lacks; '
+             'run infer.py without --daemon (ml-runner.js then spawns its own subprocess)')
+        sys.exit(2)
+    socket_path = args[args.index('--socket') + 1] if '--socket' in args else _socket_path_setting()
+    # The models are already loaded at import; checking before validation, the
+    # retrieval imports and warm-up at least spares a duplicate daemon those
+    if daemon and not _claim_socket(socket_path):
+        _log(f'Another daemon is already listening on {socket_path}')
+        sys.exit(1)
+    if _model is not None:
+        # Startup model gets the same record as a reloaded one; its smoke score is the bar to beat
+        _model.loaded_at = time.time()
+        _model.load_ms = _LOAD_TIMINGS['model_ms']
+        _model.validation = _validate(_model)
+    ready = prewarm() if daemon or '--prewarm' in args else None
+    # Fork before starting any threads of our own
+    if PROCS > 1:
+        _pool = _WorkerPool(PROCS)
+    pool = ThreadPoolExecutor(max_workers=max(1, WORKERS), thread_name_prefix='infer')
+    if MODEL_WATCH_S > 0:
+        threading.Thread(target=_watch_model, name='model-watch', daemon=True).start()
+    if ready is not None:
+        ready['procs'] = PROCS
+    sys.stderr.write(f'[infer.py] Ready ({PROCS} worker processes)\n' if _pool else '[infer.py] Ready\n')
+    sys.stderr.flush()
+
+    try:
+        if daemon:
+            serve_daemon(socket_path, ready, pool)
+        else:
+            if ready is not None:
+                _respond(ready)
+            for line in sys.stdin:
+                _accept(line, pool)
+    finally:
+        pool.shutdown(wait=True)
+        if _pool is not None:
+            _pool.close()
 
 
 if __name__ == '__main__':
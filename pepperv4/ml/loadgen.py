@@ -0,0 +1,358 @@
+"""
+Open-loop load generator for the infer.py protocol.
+
+Replays a JSONL trace of requests against a fresh `infer.py --prewarm`
+subprocess (or a running daemon with --socket), speaking the same id-multiplexed
+NDJSON that pipeline/ml-runner.js does. Requests are sent on schedule whether or
+not earlier ones have come back, and latency is measured from the scheduled send
+time, so a backed-up process shows up as queueing rather than as a lower rate.
+
+Per run it reports end-to-end latency percentiles, queue wait (end-to-end minus
+the service time infer.py reports in "_timing"), achieved throughput, and the
+timeout and error rates, where a timeout is no reply within ml-runner's
+CALL_TIMEOUT_MS. --sweep steps the rate up until the process saturates and
+reports the highest rate it sustained.
+
+Trace lines are request objects as sent to infer.py, optionally with "t"
+(seconds; relative to the first line) for replay at the recorded pacing. phase_b
+and phase_ab lines without an "inventory" get the corpus inventory attached.
+ml-runner.js records such a trace when PEPPER_ML_TRACE is set.
+
+Usage:
+  python ml/loadgen.py --rate 50 --duration 30                 # synthetic trace, 50 req/s
+  python ml/loadgen.py --trace calls.jsonl --speed 2           # recorded pacing, twice as fast
+  python ml/loadgen.py --trace calls.jsonl --rate 100          # recorded requests at 100 req/s
+  python ml/loadgen.py --sweep --files 1000 --out load.json    # find the saturation point
+  python ml/loadgen.py --socket /tmp/pepper-infer-1000.sock    # against a running daemon
+
+The subprocess inherits the environment, so PEPPER_INFER_PROCS, PEPPER_RETRIEVAL,
+PEPPER_INFER_MEMORY_MB etc. apply as they would in production.
+"""
+
+import argparse, itertools, json, random, socket, subprocess, sys, tempfile, threading, time
+from pathlib import Path
+
+from bench import QUERIES, TOPIC_WORDS, build_corpus, _environment, _percentile
+
+ML_DIR = Path(__file__).parent
+INFER_SCRIPT = ML_DIR / 'infer.py'
+# Same as ml-runner.js
+CALL_TIMEOUT_S = 10.0
+READY_TIMEOUT_S = 30.0
+# A sweep step is saturated if it falls this far behind the offered rate, or
+# times out more than this fraction of requests, or misses the p99 SLO
+SATURATION_THROUGHPUT = 0.9
+SATURATION_TIMEOUTS = 0.01
+
+
+# ---------------------------------------------------------------------------
+# Traces
+# ---------------------------------------------------------------------------
+def synthetic_trace(n: int, mix: dict, seed: int = 0) -> list:
+    """n requests drawn from mix ({task: weight}); prompts vary so caches see realistic misses."""
+    rng = random.Random(seed)
+    tasks, weights = zip(*mix.items())
+    trace = []
+    for _ in range(n):
+        task = rng.choices(tasks, weights)[0]
+        prompt = rng.choice(QUERIES)
+        if rng.random() < 0.7:
+            prompt += ' ' + ' '.join(rng.sample(TOPIC_WORDS, rng.randint(1, 4)))
+        trace.append({'task': task, 'prompt': prompt})
+    return trace
+
+
+def load_trace(path: Path) -> list:
+    trace = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                trace.append(json.loads(line))
+    if not trace:
+        raise SystemExit(f'{path}: empty trace')
+    return trace
+
+
+def schedule(trace: list, rate: float, duration: float, speed: float, rng: random.Random) -> list:
+    """
+    (send offset in seconds, request) pairs. With a rate, arrivals are Poisson at
+    that rate for duration seconds, cycling through the trace; without one, the
+    trace's own "t" offsets are replayed, compressed by speed.
+    """
+    if rate:
+        out, t = [], 0.0
+        for req in itertools.cycle(trace):
+            t += rng.expovariate(rate)
+            if t >= duration:
+                return out
+            out.append((t, req))
+    if any('t' not in req for req in trace):
+        raise SystemExit('trace has requests without "t"; pass --rate to pace it')
+    t0 = min(req['t'] for req in trace)
+    return sorted(((req['t'] - t0) / speed, req) for req in trace)
+
+
+# ---------------------------------------------------------------------------
+# Connection to infer.py
+# ---------------------------------------------------------------------------
+class Connection:
+    """One infer.py link (spawned subprocess or daemon socket): write lines, read replies."""
+
+    def __init__(self, socket_path: str = None):
+        self.proc = self.sock = None
+        if socket_path:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(socket_path)
+            self._out = self.sock.makefile('wb')
+            self._in = self.sock.makefile('rb')
+        else:
+            self.proc = subprocess.Popen(
+                [sys.executable, str(INFER_SCRIPT), '--prewarm'],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            )
+            self._out, self._in = self.proc.stdin, self.proc.stdout
+        self._write_lock = threading.Lock()
+
+    def ready(self) -> dict:
+        deadline = time.monotonic() + READY_TIMEOUT_S
+        while time.monotonic() < deadline:
+            line = self._in.readline()
+            if not line:
+                break
+            msg = json.loads(line)
+            if msg.get('event') == 'ready':
+                return msg
+        raise SystemExit('infer.py did not report ready')
+
+    def send(self, line: bytes):
+        with self._write_lock:
+            self._out.write(line)
+            self._out.flush()
+
+    def listen(self, on_reply):
+        """Read replies on one background thread for the life of the link, passing each to on_reply."""
+        self.on_reply = on_reply
+
+        def reader():
+            for line in self._in:
+                if line.strip():
+                    self.on_reply(json.loads(line), time.perf_counter())
+
+        threading.Thread(target=reader, daemon=True).start()
+
+    def close(self):
+        try:
+            self._out.close()
+        except OSError:
+            pass
+        if self.proc is not None:
+            try:
+                self.proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        if self.sock is not None:
+            self.sock.close()
+
+
+# ---------------------------------------------------------------------------
+# One run at one rate
+# ---------------------------------------------------------------------------
+def _encode(req: dict, req_id: int, inventory_json: str) -> bytes:
+    """Request line with an id and timing on; the pre-serialized inventory is spliced in."""
+    body = {k: v for k, v in req.items() if k != 't'}
+    body['id'] = req_id
+    body['timing'] = True
+    line = json.dumps(body)
+    if req.get('task') in ('phase_b', 'phase_ab') and 'inventory' not in req:
+        line = line[:-1] + ', "inventory": ' + inventory_json + '}'
+    return line.encode() + b'\n'
+
+
+def run(conn: Connection, plan: list, inventory_json: str, ids, window_s: float = None) -> dict:
+    """
+    Send plan open-loop and collect one record per request. window_s is the
+    period the plan covers (the run duration for Poisson arrivals), from which
+    the offered rate is taken.
+    """
+    records = {}      # id -> {task, scheduled, done, service_ms, error}
+    lock = threading.Lock()
+    finished = threading.Event()
+    outstanding = [len(plan)]
+
+    def on_reply(msg, now):
+        with lock:
+            rec = records.get(msg.get('id'))
+            if rec is None or 'done' in rec:
+                return
+            rec['done'] = now
+            rec['error'] = 'error' in msg
+            rec['service_ms'] = (msg.get('_timing') or {}).get('total_ms')
+            outstanding[0] -= 1
+            if outstanding[0] == 0:
+                finished.set()
+
+    conn.on_reply = on_reply
+    start = time.perf_counter() + 0.05
+    for offset, req in plan:
+        req_id = next(ids)
+        line = _encode(req, req_id, inventory_json)
+        scheduled = start + offset
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        with lock:
+            records[req_id] = {'task': req.get('task'), 'scheduled': scheduled}
+        conn.send(line)
+    finished.wait(timeout=CALL_TIMEOUT_S)
+    with lock:
+        # Anything still unanswered counts as a timeout; late replies are ignored from here on
+        for rec in records.values():
+            rec.setdefault('done', None)
+        result = list(records.values())
+    return {'records': result, 'start': start, 'window_s': window_s or (plan[-1][0] if plan else 0.0)}
+
+
+def summarize(out: dict) -> dict:
+    records, start, window_s = out['records'], out['start'], out['window_s']
+
+    def stats(recs):
+        e2e = sorted((r['done'] - r['scheduled']) * 1000 for r in recs if r['done'] is not None)
+        ok = [r for r in recs if r['done'] is not None]
+        timeouts = [r for r in recs if r['done'] is None or r['done'] - r['scheduled'] > CALL_TIMEOUT_S]
+        service = sorted(r['service_ms'] for r in ok if r.get('service_ms') is not None)
+        wait = sorted(
+            max(0.0, (r['done'] - r['scheduled']) * 1000 - r['service_ms'])
+            for r in ok if r.get('service_ms') is not None
+        )
+        n = len(recs)
+        return {
+            'requests': n,
+            'latency_ms': {p: round(_percentile(e2e, q), 2) for p, q in (('p50', 50), ('p90', 90), ('p99', 99), ('max', 100))},
+            'queue_wait_ms': {p: round(_percentile(wait, q), 2) for p, q in (('p50', 50), ('p99', 99))},
+            'service_ms': {p: round(_percentile(service, q), 2) for p, q in (('p50', 50), ('p99', 99))},
+            'timeout_rate': round(len(timeouts) / n, 4) if n else 0.0,
+            'error_rate': round(sum(1 for r in ok if r['error']) / n, 4) if n else 0.0,
+        }
+
+    answered = [r['done'] for r in records if r['done'] is not None]
+    # Throughput over the offered window, stretched to the last reply if the process fell behind
+    span = max([window_s] + [done - start for done in answered])
+    by_task = {}
+    for r in records:
+        by_task.setdefault(r['task'], []).append(r)
+    return {
+        'offered_per_s': round(len(records) / window_s, 1) if window_s else 0.0,
+        'achieved_per_s': round(len(answered) / span, 1) if span else 0.0,
+        **stats(records),
+        'tasks': {task: stats(recs) for task, recs in sorted(by_task.items())},
+    }
+
+
+def _print_summary(s: dict):
+    lat, wait = s['latency_ms'], s['queue_wait_ms']
+    print(
+        f"  offered {s['offered_per_s']:>7.1f}/s  achieved {s['achieved_per_s']:>7.1f}/s  "
+        f"p50 {lat['p50']:>8.1f}ms  p99 {lat['p99']:>8.1f}ms  max {lat['max']:>8.1f}ms  "
+        f"wait p99 {wait['p99']:>8.1f}ms  timeouts {s['timeout_rate']:.2%}  errors {s['error_rate']:.2%}",
+        flush=True,
+    )
+
+
+def saturated(s: dict, slo_ms: float) -> bool:
+    return (
+        s['achieved_per_s'] < SATURATION_THROUGHPUT * s['offered_per_s']
+        or s['timeout_rate'] > SATURATION_TIMEOUTS
+        or s['latency_ms']['p99'] > slo_ms
+    )
+
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trace', type=Path, help='JSONL trace to replay (default: synthetic)')
+    parser.add_argument('--mix', default='phase_a=0.5,phase_b=0.5', help='synthetic task weights, task=weight,...')
+    parser.add_argument('--rate', type=float, help='open-loop Poisson arrivals at this many req/s')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds per run when --rate is set')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed-up for a trace with "t"')
+    parser.add_argument('--sweep', action='store_true', help='raise the rate until saturation')
+    parser.add_argument('--start-rate', type=float, default=10.0, help='first --sweep rate')
+    parser.add_argument('--step', type=float, default=1.5, help='--sweep rate multiplier per step')
+    parser.add_argument('--max-steps', type=int, default=12)
+    parser.add_argument('--slo-ms', type=float, default=1000.0, help='p99 latency a sustainable rate must meet')
+    parser.add_argument('--files', type=int, default=200, help='synthetic memory corpus size')
+    parser.add_argument('--inventory', type=Path, help='inventory JSON (list of {name, category, description, path})')
+    parser.add_argument('--socket', help='connect to an infer.py daemon instead of spawning')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write JSON results to this file')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.trace:
+        trace = load_trace(args.trace)
+    else:
+        mix = {task: float(w) for task, w in (item.split('=') for item in args.mix.split(','))}
+        trace = synthetic_trace(5000, mix, args.seed)
+        if not args.rate and not args.sweep:
+            args.rate = 20.0
+
+    with tempfile.TemporaryDirectory(prefix='pepper-loadgen-') as tmp:
+        if args.inventory:
+            inventory = json.loads(args.inventory.read_text())
+        else:
+            inventory = build_corpus(Path(tmp), args.files, args.seed)
+        inventory_json = json.dumps(inventory)
+
+        conn = Connection(args.socket)
+        ready = conn.ready()
+        print(f"infer.py ready (pid {ready.get('pid')}, model {ready.get('model')}, "
+              f"retrieval {ready.get('retrieval')}; {len(inventory)} memory files, {len(trace)} trace requests)")
+        conn.listen(lambda msg, now: None)
+        ids = itertools.count(1)
+        # Warm the Phase B index so the first run does not pay for vectorizing the corpus
+        run(conn, [(0.0, {'task': 'phase_b', 'prompt': QUERIES[0]})], inventory_json, ids)
+
+        runs = []
+        try:
+            if args.sweep:
+                rate = args.start_rate
+                sustained = None
+                for _ in range(args.max_steps):
+                    plan = schedule(trace, rate, args.duration, args.speed, rng)
+                    s = summarize(run(conn, plan, inventory_json, ids, args.duration))
+                    runs.append(s)
+                    _print_summary(s)
+                    if saturated(s, args.slo_ms):
+                        break
+                    sustained = rate
+                    rate *= args.step
+                print(f"\nSaturation point: {f'{sustained:.1f} req/s' if sustained else 'below the first step'} "
+                      f"(p99 SLO {args.slo_ms:.0f}ms, timeouts <= {SATURATION_TIMEOUTS:.0%})")
+            else:
+                plan = schedule(trace, args.rate, args.duration, args.speed, rng)
+                s = summarize(run(conn, plan, inventory_json, ids, args.duration if args.rate else None))
+                runs.append(s)
+                _print_summary(s)
+                for task, t in s['tasks'].items():
+                    print(f"    {task:<12} n={t['requests']:<6} p50 {t['latency_ms']['p50']:>8.1f}ms  "
+                          f"p99 {t['latency_ms']['p99']:>8.1f}ms  service p50 {t['service_ms']['p50']:>7.2f}ms  "
+                          f"timeouts {t['timeout_rate']:.2%}  errors {t['error_rate']:.2%}")
+        finally:
+            conn.close()
+
+    if args.out:
+        report = {
+            'environment': _environment(),
+            'settings': {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+            'ready': ready,
+            'runs': runs,
+            'saturation_per_s': sustained if args.sweep else None,
+        }
+        Path(args.out).write_text(json.dumps(report, indent=2))
+        print(f'\nResults written to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
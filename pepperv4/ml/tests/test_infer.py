@@ -0,0 +1,271 @@
+"""
+Regression tests for infer.py. Run from pepperv4/ml:
+
+  python -m unittest discover -s tests
+"""
+
+import json, math, queue, sys, tempfile, threading, unittest
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+
+import infer
+from bench import build_corpus
+
+
+# ---------------------------------------------------------------------------
+# Phase A models
+# ---------------------------------------------------------------------------
+class CompactModelTest(unittest.TestCase):
+    PROMPTS = ['open Chrome', 'make slides about the Q3 budget and save them as deck.pptx',
+               'draw me a cat!!', 'Tell me a JOKE', 'a prompt with entirely unseen wordszz', '']
+
+    @classmethod
+    def setUpClass(cls):
+        import pickle, random
+        import train
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.multioutput import MultiOutputClassifier
+        random.seed(train.SEED)
+        texts, y = train.generate_examples()
+        texts, y = texts[::5], y[::5]
+        vectorizer = TfidfVectorizer(**train.VECTORIZER_PARAMS)
+        X = vectorizer.fit_transform(texts)
+        clf = MultiOutputClassifier(LogisticRegression(**train.CLASSIFIER_PARAMS)).fit(X, y)
+        cls._tmp = tempfile.TemporaryDirectory(prefix='pepper-test-')
+        root = Path(cls._tmp.name)
+        with open(root / 'phase_a.pkl', 'wb') as f:
+            pickle.dump({'vectorizer': vectorizer, 'classifier': clf, 'labels': train.LABELS}, f)
+        train.export_compact(vectorizer, clf, train.LABELS, root / 'phase_a.npz')
+        cls.pickled = infer._PickledModel(root / 'phase_a.pkl')
+        cls.compact = infer._CompactModel(root / 'phase_a.npz')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmp.cleanup()
+
+    def test_scores_match_pickled_model(self):
+        expected = self.pickled.scores(self.PROMPTS)
+        np.testing.assert_allclose(self.compact.scores(self.PROMPTS), expected, atol=1e-5)
+        # Preprocessed prompts take the shared n-gram path
+        prompts = [infer._Prompt(p) for p in self.PROMPTS]
+        np.testing.assert_allclose(self.compact.scores(prompts), expected, atol=1e-5)
+        self.assertEqual(self.compact.labels, self.pickled.labels)
+
+
+
+
+# ---------------------------------------------------------------------------
+# Request validation
+# ---------------------------------------------------------------------------
+class PhaseABatchTest(unittest.TestCase):
+    def test_rejects_non_list_prompts(self):
+        for prompts in ('open chrome', 42, None, {'a': 1}):
+            result = infer.handle_request({'task': 'phase_a_batch', 'prompts': prompts})
+            self.assertIn('error', result)
+            self.assertNotIn('results', result)
+
+    def test_matches_single_prompt_calls(self):
+        prompts = ['open Chrome', 'draw me a cat', 'make slides about Q3', 'open Chrome', '', 'what time is it?']
+        infer._phase_a_cache.clear()
+        batch = infer.handle_request({'task': 'phase_a_batch', 'prompts': prompts})['results']
+        infer._phase_a_cache.clear()
+        self.assertEqual(batch, [infer.run_phase_a(p) for p in prompts])
+
+
+
+class PhaseABTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory(prefix='pepper-test-')
+        self.inventory = build_corpus(Path(self._tmp.name), 40)
+
+    def tearDown(self):
+        infer._phase_a_cache.clear()
+        infer._phase_b_cache.clear()
+        self._tmp.cleanup()
+
+    def test_matches_separate_calls(self):
+        for backend in ('tfidf', 'bm25', 'lsa'):
+            # The corpus uses synthetic words, so include a prompt that shares them
+            for prompt in ('Deploy the DOCKER server!', self.inventory[3]['description'].upper(), ''):
+                infer._phase_a_cache.clear()
+                infer._phase_b_cache.clear()
+                combined = infer.run_phase_ab(prompt, self.inventory, backend)
+                infer._phase_a_cache.clear()
+                infer._phase_b_cache.clear()
+                self.assertEqual(combined, {
+                    'phase_a': infer.run_phase_a(prompt),
+                    'phase_b': infer.run_phase_b(prompt, self.inventory, backend),
+                }, (backend, prompt))
+
+
+
+class RequestIdTest(unittest.TestCase):
+    def test_replies_out_of_order_keep_their_ids(self):
+        tmp = tempfile.TemporaryDirectory(prefix='pepper-test-')
+        self.addCleanup(tmp.cleanup)
+        inventory = build_corpus(Path(tmp.name), 20)
+        replies, release = queue.Queue(), threading.Event()
+        run_phase_b = infer.run_phase_b
+
+        def held_phase_b(*args):
+            release.wait(10)
+            return run_phase_b(*args)
+
+        prompts = {2: 'open Chrome', 'b': 'draw me a cat', 3: 'make slides about Q3'}
+        with ThreadPoolExecutor(max_workers=4) as executor, \
+                mock.patch.object(infer, 'run_phase_b', held_phase_b):
+            infer._accept(json.dumps({'id': 1, 'task': 'phase_b', 'prompt': 'deploy', 'inventory': inventory}),
+                          executor, replies.put)
+            for req_id, prompt in prompts.items():
+                infer._accept(json.dumps({'id': req_id, 'task': 'phase_a', 'prompt': prompt}), executor, replies.put)
+            # The held request must not block the ones behind it
+            fast = [replies.get(timeout=10) for _ in prompts]
+            release.set()
+            slow = replies.get(timeout=10)
+
+        self.assertEqual(sorted(map(str, (r['id'] for r in fast))), sorted(map(str, prompts)))
+        for reply in fast:
+            self.assertEqual(reply, dict(infer.run_phase_a(prompts[reply['id']]), id=reply['id']))
+        self.assertEqual(slow['id'], 1)
+        self.assertIn('selectedMemories', slow)
+        self.assertTrue(replies.empty())
+
+
+# ---------------------------------------------------------------------------
+# Passage splitting
+# ---------------------------------------------------------------------------
+class SplitPassagesTest(unittest.TestCase):
+    def split(self, text):
+        return [(p['heading'], p['start'], p['end']) for p in infer._split_passages(text.splitlines(True))]
+
+    def test_comment_in_code_fence_is_not_a_heading(self):
+        text = '# Setup\nInstall first.\n\n```bash\n# install deps\nnpm ci\n```\n\n## Run\nnpm start\n'
+        self.assertEqual(self.split(text), [('Setup', 1, 8), ('Run', 9, 10)])
+
+    def test_fence_closes_only_on_matching_marker(self):
+        text = '# Notes\n````\n```\n# still code\n~~~\n````\n# After\ntext\n'
+        self.assertEqual(self.split(text), [('Notes', 1, 6), ('After', 7, 8)])
+
+
+# ---------------------------------------------------------------------------
+# Phase B indexes
+# ---------------------------------------------------------------------------
+class LSAIndexTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory(prefix='pepper-test-')
+        self.root = Path(self._tmp.name)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_shrink_below_basis_then_swap(self):
+        # A fitted basis, then a corpus too small to fit one, then a different file:
+        # the TF-IDF fallback must not keep the old vector slots around
+        inventory = build_corpus(self.root / 'a', 40)
+        other = build_corpus(self.root / 'b', 1, seed=1)
+        index = infer._LSAIndex()
+        for inv in (inventory, inventory[:1], other):
+            entries = index.sync(inv)
+            self.assertEqual(len(entries), len(inv))
+            hits = index.search('deploy the docker server', 8, 3)
+            self.assertTrue(all(entry['key'] in index._entries for _, entry, _ in hits))
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.vector_bytes, sum(e['vec_bytes'] for e in index._entries.values()))
+
+
+class BM25IndexTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory(prefix='pepper-test-')
+        self.inventory = build_corpus(Path(self._tmp.name), 60)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def brute_force(self, index, prompt):
+        """BM25 of every passage, recomputed from the raw text with no postings or bounds."""
+        docs = []
+        for entry in index._entries.values():
+            for j, p in enumerate(entry['passages']):
+                docs.append(((entry['key'], j), Counter(infer._TOKEN_RE.findall(infer._passage_text(entry['name'], p).lower()))))
+        n = len(docs)
+        avgdl = sum(sum(tf.values()) for _, tf in docs) / n
+        k1, b = index.K1, index.B
+        weights = {}
+        for term, qtf in Counter(infer._TOKEN_RE.findall(prompt.lower())).items():
+            df = sum(1 for _, tf in docs if term in tf)
+            if df:
+                weights[term] = qtf * math.log(1 + (n - df + 0.5) / (df + 0.5)) * (k1 + 1)
+        best = sum(weights.values())
+        scores = {}
+        for key, tf in docs:
+            nl = k1 * (1 - b + b * sum(tf.values()) / avgdl)
+            score = sum(w * tf[t] / (tf[t] + nl) for t, w in weights.items() if t in tf)
+            if score > 0:
+                scores[key] = score / best
+        return scores
+
+    def test_maxscore_top_k_matches_exhaustive(self):
+        index = infer._BM25Index()
+        # Sync twice with a file swapped in between, so removals are covered too
+        index.sync(self.inventory[:50])
+        index.sync(self.inventory[10:])
+        # Frequent terms have long postings, so the top-k fills early and MaxScore
+        # actually demotes lists to probing; mixed with rare and unknown terms
+        by_df = sorted(index._postings, key=lambda t: -len(index._postings[t][0]))
+        queries = [' '.join(by_df[i:i + 4]) for i in (0, 3, 10, 40)]
+        queries += [f'{by_df[0]} {by_df[-1]} {by_df[len(by_df) // 2]}', 'deploy the docker server', 'zzzq nothing']
+        for prompt in queries:
+            for k in (1, 5, 24):
+                expected = self.brute_force(index, prompt)
+                hits = index._top_k(prompt, k)
+                self.assertEqual(len(hits), min(k, len(expected)))
+                for score, entry, j in hits:
+                    self.assertAlmostEqual(score, expected[(entry['key'], j)], places=9)
+                # Same k-th best score: nothing better was skipped by the early termination
+                top = sorted(expected.values(), reverse=True)[:k]
+                self.assertEqual([round(s, 9) for s in sorted((h[0] for h in hits), reverse=True)],
+                                 [round(s, 9) for s in top])
+
+
+# ---------------------------------------------------------------------------
+# Memory budget
+# ---------------------------------------------------------------------------
+class MemoryBudgetTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory(prefix='pepper-test-')
+        self.inventory = build_corpus(Path(self._tmp.name), 50)
+        self._saved = infer._budget
+        infer._budget = infer._MemoryBudget(1)
+        infer._phase_b_cache.clear()
+
+    def tearDown(self):
+        infer._budget = self._saved
+        infer._phase_b_cache.clear()
+        infer._indexes.pop('bm25', None)
+        self._tmp.cleanup()
+
+    def test_unreachable_budget_does_not_thrash(self):
+        # The hashed tfidf index alone needs more than 1 MB, so no eviction can meet the
+        # budget: it must not flush the caches or evict the index every call instead
+        infer.run_phase_b('deploy the docker server', self.inventory)
+        infer.run_phase_b('deploy the docker server', self.inventory, backend='bm25')
+        index, _ = infer._get_index('bm25')
+        for prompt in ('summarize my notes', 'check disk usage', 'draft an email'):
+            result = infer.run_phase_b(prompt, self.inventory, backend='bm25')
+            self.assertNotIn('error', result)
+            self.assertIs(infer._get_index('bm25')[0], index)
+        self.assertEqual(infer._budget.evicted, {'results': 0, 'indexes': 0, 'texts': 0})
+        self.assertGreater(infer._budget.floor, infer._budget.limit)
+        self.assertEqual(index.texts_dropped, 0)
+        self.assertEqual(infer._phase_b_cache.stats()['size'], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
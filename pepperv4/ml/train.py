@@ -2,20 +2,60 @@
 Phase A multi-label output-type classifier.
 Generates synthetic training data, trains, evaluates, and saves the model.
 
+Writes three artifacts to models/:
+  phase_a.pkl  full sklearn vectorizer + classifier
+  phase_a.npz  compact export (vocabulary, IDF, stacked float32 coefficients)
+               that infer.py serves with NumPy only
+  route.npz    compact binary fast-path router (simple vs full pipeline),
+               served by infer.py's "route" task
+
+For months of logged traffic rather than synthetic examples, train_stream.py
+trains out of core and writes a hashed phase_a.npz that infer.py serves the same way.
+
+The generated dataset and fitted feature matrix are cached in models/.cache/,
+keyed by a hash of the templates and training settings, so a rerun with nothing
+changed skips straight to fitting. Per-label fits and CV folds run in parallel.
+
+`python train.py --search` sweeps SEARCH_GRID instead, reports per-label F1,
+latency and size with the Pareto frontier (models/search_report.json), and saves
+the smallest Phase A model meeting the F1 floor with tuned per-label thresholds.
+
+Env:
+  PEPPER_TRAIN_JOBS       worker processes for fits and CV (default -1 = all cores)
+  PEPPER_TRAIN_CACHE      set to false to ignore and not write the feature cache
+  PEPPER_SEARCH_F1_FLOOR  minimum per-label F1 for --search (default: what the
+                          current settings reach, less 0.01)
+
 Labels (independent binary):
   text, picture, command, presentation, specificFile, other
 """
 
-import pickle, random, os
+import argparse, inspect, pickle, random, os, hashlib, json, time
+from contextlib import contextmanager
 from pathlib import Path
+import sklearn
+from joblib import Parallel, delayed
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.multioutput import MultiOutputClassifier
 from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import cross_val_score
+from sklearn.model_selection import StratifiedKFold
+from sklearn.metrics import f1_score
 import numpy as np
 
 LABELS = ['text', 'picture', 'command', 'presentation', 'specificFile', 'other']
 
+SEED = 42
+VECTORIZER_PARAMS = {'ngram_range': (1, 2), 'max_features': 5000, 'sublinear_tf': True}
+CLASSIFIER_PARAMS = {'max_iter': 1000, 'C': 1.0, 'random_state': 42}
+# Simple vs pipeline is imbalanced toward the pipeline side
+ROUTE_CLASSIFIER_PARAMS = dict(CLASSIFIER_PARAMS, class_weight='balanced')
+CV_FOLDS = 5
+
+MODELS_DIR = Path(__file__).parent / 'models'
+CACHE_DIR = MODELS_DIR / '.cache'
+N_JOBS = int(os.environ.get('PEPPER_TRAIN_JOBS', '-1'))
+USE_CACHE = os.environ.get('PEPPER_TRAIN_CACHE', 'true') != 'false'
+
 TOPICS = [
     "machine learning", "Python", "climate change", "the Roman Empire",
     "quantum computing", "the stock market", "photosynthesis", "blockchain",
@@ -235,6 +275,54 @@ MULTI_LABEL_SEEDS = [
 ]
 
 
+# ---------------------------------------------------------------------------
+# Route (fast path vs full pipeline). Phase A examples whose only labels are
+# text/other are answerable in one call; anything needing a tool, an artifact,
+# or several labels needs the pipeline. These extra seeds cover what the old
+# length + opening-word heuristic got wrong in both directions.
+# ---------------------------------------------------------------------------
+ROUTE_SIMPLE_LABELS = {"text", "other"}
+
+ROUTE_SEEDS = {
+    "simple": [
+        "hey! hope you're doing well, just wanted to say thanks for the help with {topic} yesterday, it was really useful",
+        "good morning! how's everything going on your end today? I had a great weekend and just wanted to check in",
+        "hi there, long time no see, I was just thinking about our chat on {topic} and wanted to say hello",
+        "thank you so much for explaining {topic} earlier, it finally clicked for me and I really appreciate it",
+        "haha that's hilarious, you always make me laugh, anyway hope you have a nice evening",
+        "ok sounds good, thanks a lot",
+        "quick question, what does {topic} mean",
+        "remind me what {topic} is again",
+        "in one sentence, what is {topic}",
+        "who invented {topic}",
+        "when did {topic} start",
+        "how old is {topic}",
+        "is {topic} a good thing",
+        "sorry I was away for a bit, what were we talking about",
+        "no worries at all, take your time, I'm not in a rush, just let me know whenever",
+        "got it, thanks for the quick answer on {topic}",
+    ],
+    "complex": [
+        "what are the steps to deploy {topic} and save a report to {filename}",
+        "how do I set up {topic}, then write a script for it and save it as {filename}",
+        "what is the best way to build {topic} end to end and can you do it for me",
+        "can you research {topic}, compare three options, and make slides for {name}",
+        "is it possible to automate {topic} with a script and run it every morning",
+        "why does {app} crash when I open {filename}, can you fix it",
+        "hi, can you open {app} and export my notes on {topic} to {filename}",
+        "hey, please draft an email to {name} about {topic} and attach {filename}",
+        "do a full analysis of {topic} and produce a report with charts",
+        "go through {filename}, clean up the data and give me a summary with a graph",
+        "plan a migration to {topic}, write the config files and test them",
+        "how can I monitor {app}, set up alerts and log everything to {filename}",
+        "first summarize {topic}, then turn it into a presentation, then save it as {filename}",
+        "where is {filename} on my machine, open it and fix the formatting",
+        "does {app} support {topic}? if so configure it for me",
+        "build me a dashboard for {topic} and deploy it",
+    ],
+}
+
+
 def fill(template):
     t = template
     if '{topic}' in t:
@@ -279,38 +367,397 @@ def generate_examples():
     return texts, y
 
 
-def main():
-    random.seed(42)
-    print("Generating synthetic training data...")
+def generate_route_examples(texts, y):
+    """Route dataset: 1 = simple (fast path), 0 = needs the pipeline."""
+    simple_idx = [LABELS.index(l) for l in ROUTE_SIMPLE_LABELS]
+    route_texts = list(texts)
+    route_y = [int(sum(vec) == 1 and any(vec[i] for i in simple_idx)) for vec in y]
+    for route, seeds in ROUTE_SEEDS.items():
+        for seed in seeds:
+            for _ in range(15):
+                route_texts.append(fill(seed).strip())
+                route_y.append(int(route == 'simple'))
+    return route_texts, route_y
+
+
+def export_compact(vectorizer, clf, labels, out_path, thresholds=None):
+    """
+    Write the NumPy-only artifact read by infer.py's _CompactModel. clf is a
+    MultiOutputClassifier or a single binary LogisticRegression (one label).
+    Saved uncompressed so loading is a straight copy of each array.
+    """
+    if vectorizer.analyzer != 'word' or vectorizer.norm != 'l2' or not vectorizer.lowercase:
+        raise ValueError('compact export only supports lowercase word n-grams with l2 norm')
+    vocab = vectorizer.vocabulary_
+    terms = np.empty(len(vocab), dtype=object)
+    for term, j in vocab.items():
+        terms[j] = term
+    estimators = getattr(clf, 'estimators_', [clf])
+    coef = np.column_stack([est.coef_[0] for est in estimators]).astype(np.float32)
+    intercept = np.array([est.intercept_[0] for est in estimators], dtype=np.float32)
+    np.savez(
+        out_path,
+        labels=np.array(labels),
+        vocabulary=terms.astype(str),
+        idf=vectorizer.idf_.astype(np.float32),
+        coef=coef,
+        intercept=intercept,
+        ngram_range=np.array(vectorizer.ngram_range),
+        sublinear_tf=np.array(vectorizer.sublinear_tf),
+        token_pattern=np.array(vectorizer.token_pattern),
+        **({'thresholds': np.array(thresholds, dtype=np.float32)} if thresholds is not None else {}),
+    )
+
+
+def save_phase_a(vectorizer, clf, thresholds=None):
+    """Write phase_a.pkl and phase_a.npz; thresholds (one per label) override infer.py's default."""
+    model = {'vectorizer': vectorizer, 'classifier': clf, 'labels': LABELS}
+    if thresholds is not None:
+        model['thresholds'] = [float(t) for t in thresholds]
+    out_path = MODELS_DIR / 'phase_a.pkl'
+    out_path.parent.mkdir(exist_ok=True)
+    # Write-then-rename so a running infer.py never reloads a half-written artifact
+    tmp = out_path.with_suffix('.pkl.tmp')
+    with open(tmp, 'wb') as f:
+        pickle.dump(model, f)
+    os.replace(tmp, out_path)
+    print(f"\nModel saved to {out_path}")
+
+    compact_path = out_path.with_suffix('.npz')
+    tmp = out_path.with_suffix('.tmp.npz')
+    export_compact(vectorizer, clf, LABELS, tmp, thresholds)
+    os.replace(tmp, compact_path)
+    print(f"Compact model saved to {compact_path}")
+
+
+@contextmanager
+def stage(name):
+    t = time.perf_counter()
+    yield
+    print(f"[{name}: {time.perf_counter() - t:.2f}s]")
+
+
+def features_key():
+    """
+    Hash of everything that determines the dataset and feature matrix: the
+    templates and settings, and the source of the generator functions, so
+    editing how examples are filled or repeated invalidates the cache too.
+    """
+    generators = (fill, generate_examples, generate_route_examples, build_features)
+    spec = {
+        'labels': LABELS, 'seeds': SEEDS, 'multi': MULTI_LABEL_SEEDS, 'route': ROUTE_SEEDS,
+        'topics': TOPICS, 'apps': APPS, 'filenames': FILENAMES, 'names': NAMES,
+        'seed': SEED, 'vectorizer': VECTORIZER_PARAMS, 'sklearn': sklearn.__version__,
+        'generators': [inspect.getsource(f) for f in generators],
+    }
+    blob = json.dumps(spec, sort_keys=True, default=list).encode()
+    return hashlib.sha256(blob).hexdigest()[:16]
+
+
+def build_features():
+    """Generate the Phase A and route datasets and fit their vectorizers."""
+    random.seed(SEED)
     texts, y = generate_examples()
-    y_arr = np.array(y)
+    vectorizer = TfidfVectorizer(**VECTORIZER_PARAMS)
+    X = vectorizer.fit_transform(texts)
+    route_texts, route_y = generate_route_examples(texts, y)
+    route_vectorizer = TfidfVectorizer(**VECTORIZER_PARAMS)
+    route_X = route_vectorizer.fit_transform(route_texts)
+    return {
+        'texts': texts, 'y': np.array(y), 'vectorizer': vectorizer, 'X': X,
+        'route_texts': route_texts, 'route_y': np.array(route_y),
+        'route_vectorizer': route_vectorizer, 'route_X': route_X,
+    }
+
+
+def load_features():
+    """
+    Dataset + fitted vectorizer + feature matrix, from models/.cache/ when the
+    templates and settings hash matches a previous run. Stale entries are removed.
+    """
+    path = CACHE_DIR / f'features-{features_key()}.pkl'
+    if USE_CACHE and path.exists():
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f), True
+        except Exception as e:
+            print(f"Ignoring unreadable feature cache {path.name}: {e}")
+    features = build_features()
+    if USE_CACHE:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        for old in CACHE_DIR.glob('features-*.pkl'):
+            old.unlink()
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'wb') as f:
+            pickle.dump(features, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    return features, False
+
+
+def _fold_f1(X, y, train, test, params):
+    est = LogisticRegression(**params).fit(X[train], y[train])
+    return f1_score(y[test], est.predict(X[test]))
 
+
+def cross_validate(X, y_arr, params=CLASSIFIER_PARAMS):
+    """
+    F1 per label (column of y_arr) over CV_FOLDS stratified folds (the same splits
+    cross_val_score uses), with every (label, fold) fit in one parallel batch.
+    """
+    cv = StratifiedKFold(n_splits=CV_FOLDS)
+    n_labels = y_arr.shape[1]
+    jobs = [
+        (i, train, test)
+        for i in range(n_labels)
+        for train, test in cv.split(X, y_arr[:, i])
+    ]
+    scores = Parallel(n_jobs=N_JOBS)(
+        delayed(_fold_f1)(X, y_arr[:, i], train, test, params) for i, train, test in jobs
+    )
+    per_label = [[] for _ in range(n_labels)]
+    for (i, _, _), score in zip(jobs, scores):
+        per_label[i].append(score)
+    return [np.array(s) for s in per_label]
+
+
+# ---------------------------------------------------------------------------
+# Model search (`python train.py --search`). Every SEARCH_GRID combination is
+# scored on out-of-fold F1 per label, on single-prompt latency through infer.py's
+# own compact loader, and on artifact size. Per-label thresholds are tuned on the
+# out-of-fold probabilities; the F1 that ranks configurations is cross-fitted
+# (each example judged by thresholds tuned without it), since F1 measured on the
+# data the thresholds were picked on would be biased upward. Prints the Pareto frontier and
+# saves the smallest (then fastest) model whose every label meets the F1 floor:
+# PEPPER_SEARCH_F1_FLOOR if set, otherwise the current VECTORIZER_PARAMS /
+# CLASSIFIER_PARAMS configuration's own F1 per label, less F1_TOLERANCE.
+# ---------------------------------------------------------------------------
+SEARCH_GRID = {
+    'ngram_range': [(1, 1), (1, 2)],
+    'max_features': [500, 1000, 2000, 5000],
+    'C': [0.25, 1.0, 4.0],
+}
+F1_FLOOR = float(os.environ['PEPPER_SEARCH_F1_FLOOR']) if os.environ.get('PEPPER_SEARCH_F1_FLOOR') else None
+F1_TOLERANCE = 0.01
+THRESHOLD_GRID = np.round(np.arange(0.05, 0.96, 0.01), 2)
+LATENCY_SAMPLES = 200
+SEARCH_REPORT_PATH = MODELS_DIR / 'search_report.json'
+
+
+def _oof_probs(X, y, train, test, params):
+    est = LogisticRegression(**params).fit(X[train], y[train])
+    return est.predict_proba(X[test])[:, 1]
+
+
+def out_of_fold_probs(X, y_arr, params):
+    """P(label) for every example from the CV fold that held it out, shape (n, n_labels)."""
+    cv = StratifiedKFold(n_splits=CV_FOLDS)
+    jobs = [
+        (i, train, test)
+        for i in range(y_arr.shape[1])
+        for train, test in cv.split(X, y_arr[:, i])
+    ]
+    probs = Parallel(n_jobs=N_JOBS)(
+        delayed(_oof_probs)(X, y_arr[:, i], train, test, params) for i, train, test in jobs
+    )
+    P = np.zeros(y_arr.shape)
+    for (i, _, test), p in zip(jobs, probs):
+        P[test, i] = p
+    return P
+
+
+def _f1(pred, truth):
+    """F1 of boolean predictions against boolean truth, column-wise when pred is 2-D."""
+    if pred.ndim == 2:
+        truth = truth[:, None]
+    tp = (pred & truth).sum(axis=0)
+    fp = (pred & ~truth).sum(axis=0)
+    fn = (~pred & truth).sum(axis=0)
+    return np.where(tp > 0, 2 * tp / np.maximum(2 * tp + fp + fn, 1), 0.0)
+
+
+def tune_thresholds(P, y_arr):
+    """Best-F1 threshold per label over THRESHOLD_GRID; ties go to the one nearest 0.5."""
+    thresholds, f1s = [], []
+    order = np.argsort(np.abs(THRESHOLD_GRID - 0.5), kind='stable')
+    grid = THRESHOLD_GRID[order]
+    for i in range(y_arr.shape[1]):
+        f1 = _f1(P[:, i][:, None] >= grid[None, :], y_arr[:, i] == 1)
+        best = int(np.argmax(f1))
+        thresholds.append(float(grid[best]))
+        f1s.append(float(f1[best]))
+    return thresholds, f1s
+
+
+def held_out_f1(P, y_arr):
+    """
+    F1 per label with each example classified by thresholds tuned on the other
+    CV_FOLDS - 1 folds, so threshold tuning does not inflate the score.
+    """
+    pred = np.zeros(y_arr.shape, dtype=bool)
+    for i in range(y_arr.shape[1]):
+        cv = StratifiedKFold(n_splits=CV_FOLDS, shuffle=True, random_state=SEED)
+        for fit, held in cv.split(P, y_arr[:, i]):
+            (t,), _ = tune_thresholds(P[fit][:, [i]], y_arr[fit][:, [i]])
+            pred[held, i] = P[held, i] >= t
+    return [float(_f1(pred[:, i], y_arr[:, i] == 1)) for i in range(y_arr.shape[1])]
+
+
+def evaluate_config(texts, y_arr, config, workdir):
+    """Fit, cross-validate, tune and time one configuration; returns its report row."""
+    import infer  # the serving code path being timed
+    vectorizer = TfidfVectorizer(
+        ngram_range=config['ngram_range'], max_features=config['max_features'],
+        sublinear_tf=VECTORIZER_PARAMS['sublinear_tf'],
+    )
+    X = vectorizer.fit_transform(texts)
+    params = dict(CLASSIFIER_PARAMS, C=config['C'])
+    P = out_of_fold_probs(X, y_arr, params)
+    # Thresholds to ship are tuned on all of P; the F1 reported is cross-fitted
+    thresholds, _ = tune_thresholds(P, y_arr)
+    f1s = held_out_f1(P, y_arr)
+
+    clf = MultiOutputClassifier(LogisticRegression(**params), n_jobs=N_JOBS).fit(X, y_arr)
+    path = workdir / 'candidate.npz'
+    export_compact(vectorizer, clf, LABELS, path, thresholds)
+    model = infer._CompactModel(path)
+    prompts = texts[::max(1, len(texts) // LATENCY_SAMPLES)][:LATENCY_SAMPLES]
+    model.scores(prompts[:10])  # warm-up
+    samples = []
+    for prompt in prompts:
+        t = time.perf_counter()
+        model.scores([prompt])
+        samples.append((time.perf_counter() - t) * 1e6)
+    return {
+        'ngram_range': list(config['ngram_range']),
+        'max_features': config['max_features'],
+        'vocabulary': len(vectorizer.vocabulary_),
+        'C': config['C'],
+        'f1': dict(zip(LABELS, (round(f, 4) for f in f1s))),
+        'min_f1': round(min(f1s), 4),
+        'thresholds': dict(zip(LABELS, thresholds)),
+        'latency_us_p50': round(float(np.percentile(samples, 50)), 1),
+        'latency_us_p95': round(float(np.percentile(samples, 95)), 1),
+        'size_kb': round(path.stat().st_size / 1024, 1),
+        '_model': (vectorizer, clf),
+    }
+
+
+def pareto_frontier(rows):
+    """Rows no other row beats on min F1, p50 latency and size at once."""
+    def dominates(a, b):
+        no_worse = (a['min_f1'] >= b['min_f1'] and a['latency_us_p50'] <= b['latency_us_p50']
+                    and a['size_kb'] <= b['size_kb'])
+        better = (a['min_f1'] > b['min_f1'] or a['latency_us_p50'] < b['latency_us_p50']
+                  or a['size_kb'] < b['size_kb'])
+        return no_worse and better
+    return [r for r in rows if not any(dominates(o, r) for o in rows if o is not r)]
+
+
+def search():
+    import itertools, tempfile
+    t_total = time.perf_counter()
+    with stage("features"):
+        features, _ = load_features()
+    texts, y_arr = features['texts'], features['y']
+
+    keys = list(SEARCH_GRID)
+    configs = [dict(zip(keys, values)) for values in itertools.product(*SEARCH_GRID.values())]
+    current = {
+        'ngram_range': VECTORIZER_PARAMS['ngram_range'], 'max_features': VECTORIZER_PARAMS['max_features'],
+        'C': CLASSIFIER_PARAMS['C'],
+    }
+    if current not in configs:
+        configs.append(current)
+    floor_desc = f"F1 floor {F1_FLOOR}" if F1_FLOOR is not None else f"F1 floor: current config - {F1_TOLERANCE}"
+    print(f"Searching {len(configs)} configurations ({CV_FOLDS}-fold CV, {floor_desc} per label)\n")
+    rows = []
+    with stage("search"), tempfile.TemporaryDirectory() as workdir:
+        for config in configs:
+            row = evaluate_config(texts, y_arr, config, Path(workdir))
+            rows.append(row)
+            print(f"  ngrams={tuple(row['ngram_range'])} max_features={row['max_features']:<5} C={row['C']:<5} "
+                  f"min F1 {row['min_f1']:.3f}  p50 {row['latency_us_p50']:7.1f}us  {row['size_kb']:8.1f} KB")
+
+    frontier = pareto_frontier(rows)
+    frontier.sort(key=lambda r: r['size_kb'])
+    print("\nPareto frontier (min F1 / p50 latency / size):")
+    for row in frontier:
+        print(f"  ngrams={tuple(row['ngram_range'])} max_features={row['max_features']:<5} C={row['C']:<5} "
+              f"min F1 {row['min_f1']:.3f}  p50 {row['latency_us_p50']:7.1f}us  {row['size_kb']:8.1f} KB")
+
+    if F1_FLOOR is not None:
+        floors = {label: F1_FLOOR for label in LABELS}
+    else:
+        baseline = rows[configs.index(current)]
+        floors = {label: round(baseline['f1'][label] - F1_TOLERANCE, 4) for label in LABELS}
+    eligible = [r for r in rows if all(r['f1'][l] >= floors[l] for l in LABELS)]
+    chosen = min(eligible, key=lambda r: (r['size_kb'], r['latency_us_p50'])) if eligible else None
+
+    public = lambda r: {k: v for k, v in r.items() if not k.startswith('_')}
+    report = {
+        'f1_floor': floors,
+        'configs': [public(r) for r in rows],
+        'frontier': [public(r) for r in frontier],
+        'chosen': public(chosen) if chosen else None,
+    }
+    SEARCH_REPORT_PATH.parent.mkdir(exist_ok=True)
+    SEARCH_REPORT_PATH.write_text(json.dumps(report, indent=2))
+    print(f"\nReport written to {SEARCH_REPORT_PATH}")
+
+    if chosen is None:
+        best = max(rows, key=lambda r: r['min_f1'])
+        print(f"No configuration reaches the F1 floor on every label (best min F1 {best['min_f1']:.3f}); "
+              f"existing model left in place.")
+        raise SystemExit(1)
+
+    print(f"\nChosen: ngrams={tuple(chosen['ngram_range'])} max_features={chosen['max_features']} C={chosen['C']}")
+    for label in LABELS:
+        print(f"  {label}: F1 {chosen['f1'][label]:.3f} (floor {floors[label]:.3f}) "
+              f"at threshold {chosen['thresholds'][label]:.2f}")
+    with stage("save"):
+        vectorizer, clf = chosen['_model']
+        save_phase_a(vectorizer, clf, [chosen['thresholds'][l] for l in LABELS])
+    print(f"\nTotal: {time.perf_counter() - t_total:.2f}s")
+
+
+def main():
+    t_total = time.perf_counter()
+    with stage("features"):
+        features, cached = load_features()
+    texts, y_arr, vectorizer, X = features['texts'], features['y'], features['vectorizer'], features['X']
+
+    print(f"Synthetic training data ({'cached ' + features_key() if cached else 'generated'}).")
     print(f"Total examples: {len(texts)}")
     for i, label in enumerate(LABELS):
         count = y_arr[:, i].sum()
         print(f"  {label}: {int(count)} positive examples")
 
     print("\nTraining TF-IDF + MultiOutputClassifier...")
-    vectorizer = TfidfVectorizer(ngram_range=(1, 2), max_features=5000, sublinear_tf=True)
-    X = vectorizer.fit_transform(texts)
+    with stage("fit"):
+        clf = MultiOutputClassifier(LogisticRegression(**CLASSIFIER_PARAMS), n_jobs=N_JOBS)
+        clf.fit(X, y_arr)
 
-    clf = MultiOutputClassifier(LogisticRegression(max_iter=1000, C=1.0, random_state=42))
-    clf.fit(X, y_arr)
-
-    print("\nCross-validation F1 per label (5-fold):")
-    for i, label in enumerate(LABELS):
-        scores = cross_val_score(
-            LogisticRegression(max_iter=1000, C=1.0, random_state=42),
-            X, y_arr[:, i], cv=5, scoring='f1'
-        )
+    print(f"\nCross-validation F1 per label ({CV_FOLDS}-fold):")
+    with stage("cv"):
+        cv_scores = cross_validate(X, y_arr)
+    for label, scores in zip(LABELS, cv_scores):
         print(f"  {label}: {scores.mean():.3f} ± {scores.std():.3f}")
 
-    model = {'vectorizer': vectorizer, 'classifier': clf, 'labels': LABELS}
-    out_path = Path(__file__).parent / 'models' / 'phase_a.pkl'
-    out_path.parent.mkdir(exist_ok=True)
-    with open(out_path, 'wb') as f:
-        pickle.dump(model, f)
-    print(f"\nModel saved to {out_path}")
+    with stage("save"):
+        save_phase_a(vectorizer, clf)
+
+    route_y = features['route_y']
+    route_vectorizer, route_X = features['route_vectorizer'], features['route_X']
+    print(f"\nTraining route classifier ({int(route_y.sum())} simple / {int(len(route_y) - route_y.sum())} pipeline)...")
+    with stage("route"):
+        route_clf = LogisticRegression(**ROUTE_CLASSIFIER_PARAMS).fit(route_X, route_y)
+        route_scores = cross_validate(route_X, route_y[:, None], ROUTE_CLASSIFIER_PARAMS)[0]
+        route_path = MODELS_DIR / 'route.npz'
+        tmp = MODELS_DIR / 'route.tmp.npz'
+        export_compact(route_vectorizer, route_clf, ['simple'], tmp)
+        os.replace(tmp, route_path)
+    print(f"  simple F1 ({CV_FOLDS}-fold): {route_scores.mean():.3f} ± {route_scores.std():.3f}")
+    print(f"Route model saved to {route_path}")
 
     # Quick smoke test
     test_cases = [
@@ -329,6 +776,28 @@ def main():
         ok = "OK" if any(e in predicted for e in expected) else "FAIL"
         print(f"  [{ok}] '{prompt}' -> {predicted} (expected: {expected})")
 
+    route_cases = [
+        ("what is photosynthesis", "fast"),
+        ("what are the steps to deploy Docker and save a report", "pipeline"),
+        ("hey! hope your week is going great, just wanted to say thanks again for "
+         "all the help yesterday, it honestly made my whole day", "fast"),
+        ("open Chrome and download the report", "pipeline"),
+    ]
+    print("\nRoute smoke tests:")
+    for prompt, expected in route_cases:
+        p = route_clf.predict_proba(route_vectorizer.transform([prompt]))[0, 1]
+        route = "fast" if p >= 0.5 else "pipeline"
+        ok = "OK" if route == expected else "FAIL"
+        print(f"  [{ok}] '{prompt[:60]}' -> {route} (p_simple={p:.2f}, expected: {expected})")
+
+    print(f"\nTotal: {time.perf_counter() - t_total:.2f}s")
+
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Train the Phase A and route classifiers.')
+    parser.add_argument('--search', action='store_true',
+                        help='sweep Phase A settings and save the smallest model meeting the F1 floor')
+    if parser.parse_args().search:
+        search()
+    else:
+        main()
@@ -0,0 +1,251 @@
+"""
+Out-of-core Phase A training on logged, classified traffic.
+
+Streams JSONL files in chunks through a stateless HashingVectorizer (no
+vocabulary to fit, so nothing grows with the corpus) into one SGD logistic
+regression per label, updated with partial_fit. Memory is bounded by one chunk
+plus the per-label weight vectors, however large the logs are.
+
+Input, one JSON object per line:
+  {"prompt": "...", "labels": ["text", "specificFile"]}
+"labels" may also be a {label: 0/1} dict, or the field may be "outputLabels"
+(the Phase A spec as logged). Lines that do not parse are counted and skipped.
+
+Writes models/phase_a.npz in the hashed compact format, which infer.py serves
+(and hot-reloads) like train.py's artifact. Progress is checkpointed to
+models/.cache/stream-checkpoint.pkl; --resume continues from the last
+checkpoint if the inputs and settings are the same. F1 is measured
+progressively: each chunk is scored before the learners see it.
+
+Usage:
+  python train_stream.py logs/*.jsonl [--epochs N] [--resume]
+
+Env:
+  PEPPER_STREAM_CHUNK       examples per partial_fit call (default 10000)
+  PEPPER_STREAM_CHECKPOINT  chunks between checkpoints (default 10)
+"""
+
+import argparse, hashlib, json, os, pickle, time
+from pathlib import Path
+import sklearn
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import SGDClassifier
+import numpy as np
+
+from train import LABELS, SEED, MODELS_DIR, CACHE_DIR, stage
+
+# Stateless features: the same prompt always hashes to the same columns, so any
+# chunk can be vectorized on its own and infer.py can rebuild the vectorizer
+# from these settings alone
+HASH_PARAMS = {
+    'n_features': 2 ** 20, 'ngram_range': (1, 2), 'alternate_sign': False,
+    'binary': True, 'norm': 'l2',
+}
+SGD_PARAMS = {'loss': 'log_loss', 'alpha': 1e-5, 'random_state': SEED}
+
+CHUNK_SIZE = int(os.environ.get('PEPPER_STREAM_CHUNK', '10000'))
+CHECKPOINT_EVERY = int(os.environ.get('PEPPER_STREAM_CHECKPOINT', '10'))
+CHECKPOINT_PATH = CACHE_DIR / 'stream-checkpoint.pkl'
+
+
+def parse_example(line):
+    """(prompt, 0/1 label vector) from one JSONL line, or None if unusable."""
+    try:
+        obj = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(obj, dict):
+        return None
+    prompt = obj.get('prompt')
+    labels = obj.get('labels', obj.get('outputLabels'))
+    if not isinstance(prompt, str) or not prompt.strip():
+        return None
+    if isinstance(labels, dict):
+        vec = [int(bool(labels.get(l))) for l in LABELS]
+    elif isinstance(labels, list):
+        vec = [int(l in labels) for l in LABELS]
+    else:
+        return None
+    return prompt, vec
+
+
+def read_chunks(files, file_index=0, offset=0):
+    """
+    Yield (examples, skipped, file_index, offset) per CHUNK_SIZE examples, where
+    (file_index, offset) is where the next chunk starts; a chunk never spans files.
+    """
+    for fi in range(file_index, len(files)):
+        start = offset if fi == file_index else 0
+        with open(files[fi], 'rb') as f:
+            f.seek(start)
+            pos = start
+            examples, skipped = [], 0
+            for raw in f:
+                pos += len(raw)
+                if not raw.strip():
+                    continue
+                ex = parse_example(raw.decode('utf-8', errors='replace'))
+                if ex is None:
+                    skipped += 1
+                    continue
+                examples.append(ex)
+                if len(examples) >= CHUNK_SIZE:
+                    yield examples, skipped, fi, pos
+                    examples, skipped = [], 0
+            if examples or skipped:
+                yield examples, skipped, fi + 1, 0
+
+
+def run_key(files):
+    """Hash of the inputs and settings; a checkpoint only resumes a run with the same key."""
+    spec = {
+        'files': [str(Path(f).resolve()) for f in files], 'labels': LABELS,
+        'hash': HASH_PARAMS, 'sgd': SGD_PARAMS, 'chunk': CHUNK_SIZE, 'sklearn': sklearn.__version__,
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def new_state(files, epochs):
+    return {
+        'key': run_key(files), 'epochs': epochs, 'epoch': 0, 'file_index': 0, 'offset': 0,
+        'chunks': 0, 'seen': 0, 'skipped': 0,
+        'learners': [SGDClassifier(**SGD_PARAMS) for _ in LABELS],
+        # Progressive validation counts for the current epoch: (tp, fp, fn) per label
+        'counts': np.zeros((len(LABELS), 3), dtype=np.int64),
+    }
+
+
+def save_checkpoint(state):
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = CHECKPOINT_PATH.with_suffix('.tmp')
+    with open(tmp, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, CHECKPOINT_PATH)
+
+
+def load_checkpoint(files):
+    try:
+        with open(CHECKPOINT_PATH, 'rb') as f:
+            state = pickle.load(f)
+    except FileNotFoundError:
+        print("No checkpoint; starting from scratch.")
+        return None
+    except Exception as e:
+        print(f"Ignoring unreadable checkpoint: {e}")
+        return None
+    if state.get('key') != run_key(files):
+        print("Checkpoint is for different inputs or settings; starting from scratch.")
+        return None
+    return state
+
+
+def score_chunk(learners, X, Y, counts):
+    """Add tp/fp/fn of the current learners on a chunk they have not trained on yet."""
+    if not hasattr(learners[0], 'coef_'):
+        return
+    for i, est in enumerate(learners):
+        pred = est.decision_function(X) > 0
+        truth = Y[:, i] == 1
+        counts[i] += (np.sum(pred & truth), np.sum(pred & ~truth), np.sum(~pred & truth))
+
+
+def f1_scores(counts):
+    tp, fp, fn = counts[:, 0], counts[:, 1], counts[:, 2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(tp > 0, 2 * tp / (2 * tp + fp + fn), 0.0)
+
+
+def export_hashed(learners, labels, out_path):
+    """
+    Write the hashed compact artifact read by infer.py's _HashedModel. Only
+    coefficient rows with a non-zero weight are stored; a hash column no
+    training prompt ever hit contributes nothing.
+    """
+    W = np.column_stack([est.coef_[0] for est in learners]).astype(np.float32)
+    rows = np.flatnonzero(np.any(W != 0, axis=1)).astype(np.int32)
+    np.savez(
+        out_path,
+        labels=np.array(labels),
+        rows=rows,
+        coef=W[rows],
+        intercept=np.array([est.intercept_[0] for est in learners], dtype=np.float32),
+        n_features=np.array(HASH_PARAMS['n_features']),
+        ngram_range=np.array(HASH_PARAMS['ngram_range']),
+        binary=np.array(HASH_PARAMS['binary']),
+        norm=np.array(HASH_PARAMS['norm']),
+        alternate_sign=np.array(HASH_PARAMS['alternate_sign']),
+        token_pattern=np.array(HashingVectorizer().token_pattern),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('files', nargs='+', type=Path, help='JSONL files of classified prompts')
+    parser.add_argument('--epochs', type=int, default=1, help='passes over the input (default 1)')
+    parser.add_argument('--resume', action='store_true', help='continue from the last checkpoint')
+    args = parser.parse_args()
+
+    t_total = time.perf_counter()
+    state = load_checkpoint(args.files) if args.resume else None
+    if state is None:
+        state = new_state(args.files, args.epochs)
+    else:
+        state['epochs'] = args.epochs
+        print(f"Resuming at epoch {state['epoch'] + 1}, file {state['file_index'] + 1}/{len(args.files)}, "
+              f"{state['seen']} examples seen.")
+
+    vectorizer = HashingVectorizer(**HASH_PARAMS)
+    classes = np.array([0, 1])
+    learners = state['learners']
+
+    while state['epoch'] < state['epochs']:
+        print(f"\nEpoch {state['epoch'] + 1}/{state['epochs']}")
+        t_epoch = time.perf_counter()
+        for examples, skipped, file_index, offset in read_chunks(args.files, state['file_index'], state['offset']):
+            if state['epoch'] == 0:
+                # Every epoch reads the same lines; count the unusable ones once
+                state['skipped'] += skipped
+            if examples:
+                # Shuffle within the chunk; seeded by position so a resumed run matches an uninterrupted one
+                rng = np.random.RandomState(SEED + state['chunks'])
+                order = rng.permutation(len(examples))
+                X = vectorizer.transform([examples[j][0] for j in order])
+                Y = np.array([examples[j][1] for j in order], dtype=np.int8)
+                score_chunk(learners, X, Y, state['counts'])
+                for i, est in enumerate(learners):
+                    est.partial_fit(X, Y[:, i], classes=classes)
+                state['seen'] += len(examples)
+            state['chunks'] += 1
+            state['file_index'], state['offset'] = file_index, offset
+            if state['chunks'] % CHECKPOINT_EVERY == 0:
+                save_checkpoint(state)
+                rate = state['seen'] / (time.perf_counter() - t_total)
+                print(f"  {state['seen']} examples ({rate:.0f}/s), checkpointed")
+
+        f1 = f1_scores(state['counts'])
+        print(f"  epoch done in {time.perf_counter() - t_epoch:.2f}s; progressive F1 per label:")
+        for label, score in zip(LABELS, f1):
+            print(f"    {label}: {score:.3f}")
+        state['epoch'] += 1
+        state['file_index'], state['offset'] = 0, 0
+        state['counts'][:] = 0
+        save_checkpoint(state)
+
+    if not hasattr(learners[0], 'coef_'):
+        raise SystemExit("No usable examples in the input; nothing written.")
+    print(f"\n{state['seen']} examples trained, {state['skipped']} input lines skipped.")
+
+    with stage("save"):
+        out_path = MODELS_DIR / 'phase_a.npz'
+        out_path.parent.mkdir(exist_ok=True)
+        # Write-then-rename so a running infer.py never reloads a half-written artifact
+        tmp = MODELS_DIR / 'phase_a.tmp.npz'
+        export_hashed(learners, LABELS, tmp)
+        os.replace(tmp, out_path)
+        print(f"Hashed compact model saved to {out_path}")
+
+    print(f"\nTotal: {time.perf_counter() - t_total:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
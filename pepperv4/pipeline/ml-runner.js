@@ -1,8 +1,19 @@
 // ml-runner.js — Node.js integration layer for the local ML inference subprocess.
-// Keeps a single persistent Python subprocess alive (lazy init) and communicates
-// via newline-delimited JSON over stdin/stdout.
+// Keeps a single persistent Python subprocess alive and communicates via
+// newline-delimited JSON over stdin/stdout. Every request carries an `id` that
+// infer.py echoes back, so replies are routed by id and may arrive out of order.
+// The subprocess is started with --prewarm; calls are held until it reports
+// ready, so no caller's timeout is spent on Python start-up. startMlRunner()
+// lets the host start it eagerly at boot. With PEPPER_INFER_PROCS set, the
+// subprocess pre-forks that many worker processes behind the same pipe.
+// If an infer.py daemon (`infer.py --daemon`) is listening on the Unix socket,
+// the runner connects to it instead of spawning, so one warm process serves
+// every Node process on the host.
 
 import { spawn } from 'child_process';
+import { createWriteStream, existsSync } from 'fs';
+import { createConnection } from 'net';
+import { tmpdir } from 'os';
 import { join, dirname } from 'path';
 import { fileURLToPath } from 'url';
 
@@ -10,38 +21,126 @@ const __dirname = dirname(fileURLToPath(import.meta.url));
 const INFER_SCRIPT = join(__dirname, '../ml/infer.py');
 const PYTHON = process.env.PEPPER_PYTHON || 'python';
 const CALL_TIMEOUT_MS = 10000;
+const READY_TIMEOUT_MS = 30000;
+// Ask infer.py for per-stage timings on every call and log them (diagnostics only)
+const LOG_TIMING = process.env.PEPPER_ML_TIMING === 'true';
+// Append every call to this JSONL file for replay with ml/loadgen.py (inventories are left out)
+const TRACE_PATH = process.env.PEPPER_ML_TRACE || '';
+let traceStream = null;
+// Same default path as infer.py; PEPPER_INFER_DAEMON=false always spawns a private subprocess
+const SOCKET_PATH = process.env.PEPPER_INFER_SOCKET || join(tmpdir(), `pepper-infer-${process.getuid?.() ?? 0}.sock`);
+const USE_DAEMON = process.env.PEPPER_INFER_DAEMON !== 'false';
 
-let proc = null;
+// Current connection to infer.py: { kind: 'spawn' | 'daemon', pid, write(line), end() }
+let link = null;
 let stdoutBuffer = '';
-// Queue of pending calls: { resolve, reject, timer }
-const pendingQueue = [];
+let nextId = 1;
+// Pending calls by request id: id -> { resolve, reject, timer }
+const pending = new Map();
+// Ready message from the current subprocess; null while it is still warming up
+let readyInfo = null;
+// Work waiting for the ready message: { send, reject, timer }
+const held = [];
+
+function rejectAll(err) {
+  for (const [id, entry] of pending) {
+    clearTimeout(entry.timer);
+    pending.delete(id);
+    entry.reject(err);
+  }
+  for (const entry of held.splice(0)) {
+    clearTimeout(entry.timer);
+    entry.reject(err);
+  }
+}
+
+// Timeouts are marked so callers can tell a hung subprocess from a failed request
+function timeoutError(message) {
+  const err = new Error(message);
+  err.timeout = true;
+  return err;
+}
+
+function hold(send, reject, label) {
+  const entry = { send, reject };
+  entry.timer = setTimeout(() => {
+    const idx = held.indexOf(entry);
+    if (idx !== -1) held.splice(idx, 1);
+    reject(timeoutError(`[ml-runner] subprocess not ready after ${READY_TIMEOUT_MS}ms for task: ${label}`));
+  }, READY_TIMEOUT_MS);
+  held.push(entry);
+  return entry;
+}
+
+function onReady(info) {
+  readyInfo = info;
+  const t = info.timings || {};
+  process.stderr.write(`[ml-runner] ${link?.kind === 'daemon' ? `daemon (pid ${info.pid})` : 'subprocess'} ready in ${t.total_ms}ms (model ${t.model_ms}ms, warmup ${t.warmup_ms}ms, ${info.model || 'no model'}${info.procs > 1 ? `, ${info.procs} worker processes` : ''})\n`);
+  for (const entry of held.splice(0)) {
+    clearTimeout(entry.timer);
+    entry.send();
+  }
+}
+
+function onData(chunk) {
+  stdoutBuffer += chunk.toString();
+  const lines = stdoutBuffer.split('\n');
+  stdoutBuffer = lines.pop(); // keep incomplete last chunk
+  for (const line of lines) {
+    const trimmed = line.trim();
+    if (!trimmed) continue;
+    let msg;
+    try {
+      msg = JSON.parse(trimmed);
+    } catch (e) {
+      process.stderr.write(`[ml-runner] JSON parse failed: ${trimmed}\n`);
+      continue;
+    }
+    if (msg.event === 'ready') {
+      if (link && link.pid == null) link.pid = msg.pid ?? null;
+      onReady(msg);
+      continue;
+    }
+    const { id, ...result } = msg;
+    const entry = pending.get(id);
+    if (!entry) {
+      // Unknown id: a reply that arrived after its caller timed out, or an
+      // error for a line infer.py could not parse
+      process.stderr.write(`[ml-runner] Unexpected output: ${trimmed}\n`);
+      continue;
+    }
+    pending.delete(id);
+    clearTimeout(entry.timer);
+    if (result._timing) {
+      const stages = Object.entries(result._timing).map(([k, v]) => `${k}=${v}`).join(' ');
+      process.stderr.write(`[ml-runner] ${entry.task} timing: ${stages}\n`);
+      delete result._timing;
+    }
+    entry.resolve(result);
+  }
+}
+
+// Each connect/spawn gets its own link object, so events from a link that has
+// since been replaced are ignored
+function openLink(kind, pid, write, end) {
+  readyInfo = null;
+  stdoutBuffer = '';
+  link = { kind, pid, write, end };
+  return link;
+}
 
 function startProcess() {
-  proc = spawn(PYTHON, [INFER_SCRIPT], {
+  const proc = spawn(PYTHON, [INFER_SCRIPT, '--prewarm'], {
     stdio: ['pipe', 'pipe', 'pipe'],
     shell: false,
   });
+  const self = openLink('spawn', proc.pid, line => proc.stdin.write(line), () => proc.stdin.end());
+  // An idle runner must not keep the host process alive (startMlRunner() runs at
+  // import); in-flight calls still do, through their timeout timers
+  proc.unref();
+  for (const stream of [proc.stdin, proc.stdout, proc.stderr]) stream.unref?.();
 
-  proc.stdout.on('data', chunk => {
-    stdoutBuffer += chunk.toString();
-    const lines = stdoutBuffer.split('\n');
-    stdoutBuffer = lines.pop(); // keep incomplete last chunk
-    for (const line of lines) {
-      const trimmed = line.trim();
-      if (!trimmed) continue;
-      const pending = pendingQueue.shift();
-      if (!pending) {
-        process.stderr.write(`[ml-runner] Unexpected output: ${trimmed}\n`);
-        continue;
-      }
-      clearTimeout(pending.timer);
-      try {
-        pending.resolve(JSON.parse(trimmed));
-      } catch (e) {
-        pending.reject(new Error(`[ml-runner] JSON parse failed: ${trimmed}`));
-      }
-    }
-  });
+  proc.stdout.on('data', onData);
 
   proc.stderr.on('data', chunk => {
     process.stderr.write(`[ml-runner] ${chunk}`);
@@ -49,55 +148,136 @@ function startProcess() {
 
   proc.on('close', code => {
     process.stderr.write(`[ml-runner] subprocess exited (code ${code})\n`);
-    proc = null;
+    if (link && link !== self) return;
+    link = null;
     // Reject any pending calls
-    while (pendingQueue.length > 0) {
-      const pending = pendingQueue.shift();
-      clearTimeout(pending.timer);
-      pending.reject(new Error(`[ml-runner] subprocess exited unexpectedly (code ${code})`));
-    }
+    rejectAll(new Error(`[ml-runner] subprocess exited unexpectedly (code ${code})`));
   });
 
   proc.on('error', err => {
     process.stderr.write(`[ml-runner] spawn error: ${err.message}\n`);
-    proc = null;
-    while (pendingQueue.length > 0) {
-      const pending = pendingQueue.shift();
-      clearTimeout(pending.timer);
-      pending.reject(err);
+    if (link && link !== self) return;
+    link = null;
+    rejectAll(err);
+  });
+}
+
+function connectDaemon() {
+  const socket = createConnection(SOCKET_PATH);
+  const self = openLink('daemon', null, line => socket.write(line), () => socket.end());
+  socket.unref();  // as for a spawned subprocess
+  let connected = false;
+
+  socket.on('connect', () => {
+    connected = true;
+  });
+  socket.on('data', onData);
+
+  socket.on('error', err => {
+    if (link !== self) return;
+    if (!connected) {
+      // Stale socket file or daemon still starting: run a private subprocess instead.
+      // Held calls stay held and go to the subprocess once it is ready.
+      process.stderr.write(`[ml-runner] no daemon at ${SOCKET_PATH} (${err.code}); spawning infer.py\n`);
+      link = null;
+      startProcess();
+      return;
     }
+    process.stderr.write(`[ml-runner] daemon connection error: ${err.message}\n`);
+  });
+
+  socket.on('close', () => {
+    if (link && link !== self) return;
+    if (link === self) process.stderr.write('[ml-runner] daemon connection closed\n');
+    link = null;
+    rejectAll(new Error('[ml-runner] inference daemon connection closed'));
   });
 }
 
 function ensureProcess() {
-  if (!proc || proc.killed) {
-    startProcess();
+  if (link) return;
+  if (USE_DAEMON && existsSync(SOCKET_PATH)) connectDaemon();
+  else startProcess();
+}
+
+function recordTrace(payload) {
+  if (!traceStream) {
+    traceStream = createWriteStream(TRACE_PATH, { flags: 'a' });
+    traceStream.on('error', (err) => {
+      process.stderr.write(`[ml-runner] Trace disabled: ${err.message}\n`);
+      traceStream = { write() {} };
+    });
   }
+  const { inventory, ...rest } = payload;
+  traceStream.write(JSON.stringify({ t: Date.now() / 1000, ...rest }) + '\n');
 }
 
 function call(payload) {
+  if (TRACE_PATH) recordTrace(payload);
   return new Promise((resolve, reject) => {
     ensureProcess();
-    const timer = setTimeout(() => {
-      // Remove from queue and reject
-      const idx = pendingQueue.findIndex(p => p.timer === timer);
-      if (idx !== -1) pendingQueue.splice(idx, 1);
-      reject(new Error(`[ml-runner] timeout after ${CALL_TIMEOUT_MS}ms for task: ${payload.task}`));
-    }, CALL_TIMEOUT_MS);
-
-    pendingQueue.push({ resolve, reject, timer });
-    try {
-      proc.stdin.write(JSON.stringify(payload) + '\n');
-    } catch (err) {
-      clearTimeout(timer);
-      pendingQueue.pop();
-      reject(err);
-    }
+    const id = nextId++;
+    const send = () => {
+      const timer = setTimeout(() => {
+        // Forget the id so a late reply is dropped instead of resolving someone else
+        pending.delete(id);
+        reject(timeoutError(`[ml-runner] timeout after ${CALL_TIMEOUT_MS}ms for task: ${payload.task}`));
+      }, CALL_TIMEOUT_MS);
+
+      pending.set(id, { resolve, reject, timer, task: payload.task });
+      try {
+        const message = LOG_TIMING ? { ...payload, id, timing: true } : { ...payload, id };
+        link.write(JSON.stringify(message) + '\n');
+      } catch (err) {
+        clearTimeout(timer);
+        pending.delete(id);
+        reject(err);
+      }
+    };
+
+    if (readyInfo) send();
+    else hold(send, reject, payload.task);
   });
 }
 
+// Empty Phase B result that parseAuditResult can handle
+function fallbackRetrieval(err) {
+  return {
+    selectedMemories: [],
+    missingMemories: [],
+    toolsNeeded: [],
+    notes: `ML retrieval failed: ${err.message}`,
+  };
+}
+
+// Safe Phase A result that parseOutputSpec can handle
+function fallbackSpec(prompt) {
+  return {
+    taskDescription: (prompt || '').slice(0, 500),
+    outputType: 'text',
+    outputLabels: { text: true, picture: false, command: false, presentation: false, specificFile: false, other: false },
+    outputFormat: { type: 'inline_text', structure: 'direct answer', deliveryMethod: 'inline' },
+    requiredDomains: [],
+    complexity: 'simple',
+    estimatedSteps: 1,
+  };
+}
+
 // ── Public API ──────────────────────────────────────────────────────────────
 
+/**
+ * Start the inference subprocess now instead of on the first call.
+ * Resolves with its ready message ({ model, retrieval, timings }) once warm.
+ */
+export function startMlRunner() {
+  return new Promise((resolve, reject) => {
+    ensureProcess();
+    if (readyInfo) resolve(readyInfo);
+    // Nothing is waiting on a warm-up, so it must not keep the host process alive either
+    else hold(() => resolve(readyInfo), reject, 'startup').timer.unref();
+  });
+}
+
 /**
  * Phase A: classify the prompt into output type labels.
  * Returns a JSON string compatible with parseOutputSpec().
@@ -108,16 +288,38 @@ export async function runPhaseA(prompt) {
     return JSON.stringify(result);
   } catch (err) {
     process.stderr.write(`[ml-runner] Phase A error: ${err.message}\n`);
-    // Return a safe fallback that parseOutputSpec can handle
-    return JSON.stringify({
-      taskDescription: (prompt || '').slice(0, 500),
-      outputType: 'text',
-      outputLabels: { text: true, picture: false, command: false, presentation: false, specificFile: false, other: false },
-      outputFormat: { type: 'inline_text', structure: 'direct answer', deliveryMethod: 'inline' },
-      requiredDomains: [],
-      complexity: 'simple',
-      estimatedSteps: 1,
-    });
+    return JSON.stringify(fallbackSpec(prompt));
+  }
+}
+
+/**
+ * Phase A over many prompts in one round trip (backfills, re-classification,
+ * bursts of queued messages). Returns an array of JSON strings in input order,
+ * each compatible with parseOutputSpec().
+ */
+export async function runPhaseABatch(prompts) {
+  try {
+    const result = await call({ task: 'phase_a_batch', prompts });
+    if (result.error) throw new Error(result.error);
+    return result.results.map(spec => JSON.stringify(spec));
+  } catch (err) {
+    process.stderr.write(`[ml-runner] Phase A batch error: ${err.message}\n`);
+    return prompts.map(prompt => JSON.stringify(fallbackSpec(prompt)));
+  }
+}
+
+/**
+ * Fast-path router: { route: 'fast' | 'pipeline', p_simple, confidence } for the
+ * prompt, or null if the router is unavailable (callers then take the full pipeline).
+ */
+export async function runRoute(prompt) {
+  try {
+    const result = await call({ task: 'route', prompt });
+    if (result.error) throw new Error(result.error);
+    return result;
+  } catch (err) {
+    process.stderr.write(`[ml-runner] Route error: ${err.message}\n`);
+    return null;
   }
 }
 
@@ -132,21 +334,88 @@ export async function runPhaseB(prompt, inventory) {
     return JSON.stringify(result);
   } catch (err) {
     process.stderr.write(`[ml-runner] Phase B error: ${err.message}\n`);
-    return JSON.stringify({
-      selectedMemories: [],
-      missingMemories: [],
-      toolsNeeded: [],
-      notes: `ML retrieval failed: ${err.message}`,
-    });
+    return JSON.stringify(fallbackRetrieval(err));
+  }
+}
+
+/**
+ * Phase A and Phase B for the same prompt in one round trip; the prompt is
+ * preprocessed once and shared by both. Returns { phaseA, phaseB } as JSON
+ * strings, identical to what runPhaseA() and runPhaseB() would return.
+ */
+export async function runPhaseAB(prompt, inventory) {
+  try {
+    const result = await call({ task: 'phase_ab', prompt, inventory });
+    if (result.error) throw new Error(result.error);
+    return { phaseA: JSON.stringify(result.phase_a), phaseB: JSON.stringify(result.phase_b) };
+  } catch (err) {
+    process.stderr.write(`[ml-runner] Phase A+B error: ${err.message}\n`);
+    // A subprocess that just timed out would likely time out twice more; only
+    // other failures (e.g. a daemon too old to know phase_ab) are worth a retry
+    if (err.timeout) {
+      return { phaseA: JSON.stringify(fallbackSpec(prompt)), phaseB: JSON.stringify(fallbackRetrieval(err)) };
+    }
+    return { phaseA: await runPhaseA(prompt), phaseB: await runPhaseB(prompt, inventory) };
+  }
+}
+
+/**
+ * Near-duplicate memory files among inventory (MinHash + LSH in the subprocess,
+ * updated incrementally as files change). Resolves with
+ * { clusters: [{ files: [{ name, category, path }], similarity }], files, redundant, threshold },
+ * or { clusters: [], error } if the subprocess cannot answer.
+ */
+export async function findDuplicateMemories(inventory) {
+  try {
+    const result = await call({ task: 'dedupe', inventory });
+    if (result.error) throw new Error(result.error);
+    return result;
+  } catch (err) {
+    process.stderr.write(`[ml-runner] Dedupe error: ${err.message}\n`);
+    return { clusters: [], error: err.message };
+  }
+}
+
+/**
+ * Counters, latency histograms, index size and RSS from the inference subprocess,
+ * plus this runner's own queue state. Intended for health checks; never throws.
+ */
+export async function getMlStats() {
+  const runner = {
+    mode: link?.kind ?? null,
+    pid: link?.pid ?? null,
+    ready: readyInfo != null,
+    inFlight: pending.size,
+    waitingForReady: held.length,
+    startup: readyInfo?.timings ?? null,
+  };
+  try {
+    return { runner, ...(await call({ task: 'stats' })) };
+  } catch (err) {
+    return { runner, error: err.message };
+  }
+}
+
+/**
+ * Ask the subprocess to pick up a retrained Phase A model now rather than on its
+ * next artifact poll. Resolves with { reloaded, reason?, model }; the old model
+ * keeps serving unless the new one loads and passes its smoke tests.
+ */
+export async function reloadPhaseAModel({ force = false } = {}) {
+  try {
+    return await call({ task: 'reload', force });
+  } catch (err) {
+    return { reloaded: false, reason: err.message };
   }
 }
 
 /**
  * Gracefully shut down the Python subprocess (useful for tests / clean exit).
+ * When connected to a daemon, only this process's connection is closed.
  */
 export function shutdown() {
-  if (proc && !proc.killed) {
-    proc.stdin.end();
-    proc = null;
+  if (link) {
+    link.end();
+    link = null;
   }
 }
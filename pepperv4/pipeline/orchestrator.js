@@ -1,7 +1,7 @@
 // Pipeline orchestrator — coordinates A → B → C? → D → learn with feedback loops.
 
 import { runModel } from './model-runner.js';
-import { runPhaseA, runPhaseB } from './ml-runner.js';
+import { runPhaseAB, runPhaseB } from './ml-runner.js';
 import { buildGapPrompt as modelBGapPrompt } from './prompts/model-b.js';
 import { buildPrompt as modelCPrompt } from './prompts/model-c.js';
 import { buildPrompt as modelDPrompt } from './prompts/model-d.js';
@@ -87,8 +87,9 @@ export async function runPipeline(prompt, { onProgress, processKey, timeout, res
   }
 
   // ── Phase A: Output type classifier (local ML) ──
+  // Fused with the first Phase B pass: one round trip, one pass of prompt preprocessing
   agg.phase('A', 'Classifying request (local ML)');
-  const phaseAResponse = await runPhaseA(prompt);
+  const { phaseA: phaseAResponse, phaseB: firstPhaseBResponse } = await runPhaseAB(prompt, getFullInventory());
   const outputSpec = parseOutputSpec(phaseAResponse);
   const activeLabels = outputSpec.outputLabels
     ? Object.entries(outputSpec.outputLabels).filter(([, v]) => v).map(([k]) => k).join(', ') || 'none'
@@ -114,10 +115,12 @@ export async function runPipeline(prompt, { onProgress, processKey, timeout, res
     agg.phase('B', `Selecting relevant memory files (ML, pass ${loopCount})`);
 
     const inventory = getFullInventory();
-    const phaseBResponse = await runPhaseB(
-      previousFailure ? `${prompt}\n\nPrevious failure context: ${previousFailure.slice(0, 500)}` : prompt,
-      inventory
-    );
+    const phaseBResponse = loopCount === 1
+      ? firstPhaseBResponse
+      : await runPhaseB(
+        previousFailure ? `${prompt}\n\nPrevious failure context: ${previousFailure.slice(0, 500)}` : prompt,
+        inventory
+      );
     const audit = parseAuditResult(phaseBResponse);
     const selectedSummary = (audit.selectedMemories || [])
       .map(m => `${m.name} (${m.reason || m.category})`)
@@ -0,0 +1,29 @@
+import { describe, it } from 'node:test';
+import assert from 'node:assert/strict';
+import { routePrompt } from '../util/fast-path.js';
+
+describe('fast-path', () => {
+  it('takes the pipeline when the router is unavailable', async () => {
+    // runRoute() resolves null when route.npz is missing or the subprocess fails
+    const route = await routePrompt('hi, what time is it?', async () => null);
+    assert.equal(route.simple, false);
+    assert.equal(route.source, 'unavailable');
+  });
+
+  it('takes the pipeline when the router call throws', async () => {
+    const route = await routePrompt('hello', async () => { throw new Error('subprocess exited'); });
+    assert.equal(route.simple, false);
+    assert.equal(route.source, 'unavailable');
+  });
+
+  it('follows a confident router', async () => {
+    const route = await routePrompt('thanks!', async () => ({ route: 'fast', p_simple: 0.9, confidence: 0.9 }));
+    assert.deepEqual(route, { simple: true, confidence: 0.9, source: 'router' });
+  });
+
+  it('takes the pipeline below the confidence floor', async () => {
+    const route = await routePrompt('what are the steps to deploy', async () => ({ route: 'fast', p_simple: 0.55, confidence: 0.55 }));
+    assert.equal(route.simple, false);
+    assert.equal(route.source, 'router');
+  });
+});
@@ -1,7 +1,33 @@
 // Fast-path detection — identifies simple messages that can skip the full pipeline.
+// The learned router in ml/infer.py (route task) decides. Without it (no trained
+// models/route.npz, or the subprocess failing) every message takes the full
+// pipeline, as before the router existed.
 
-const SIMPLE_PATTERNS = /^(what|who|when|where|how|why|is|are|can|does|do|did|hi|hey|hello|thanks|ok|yes|no)\b/i;
+import { runRoute } from '../pipeline/ml-runner.js';
 
-export function isLikelySimple(prompt) {
-  return prompt.length < 200 && SIMPLE_PATTERNS.test(prompt.trim());
+// Below this router confidence the message takes the full pipeline: a wasted
+// pipeline run costs time, a thin answer to a real task costs the task
+const MIN_CONFIDENCE = Number(process.env.PEPPER_ROUTE_MIN_CONFIDENCE || 0.65);
+
+/**
+ * Decide fast path vs pipeline for a message.
+ * Returns { simple, confidence, source } where source is 'router', or
+ * 'unavailable' (simple is then false). `route` is the router call; tests
+ * substitute their own.
+ */
+export async function routePrompt(prompt, route = runRoute) {
+  let result = null;
+  try {
+    result = await route(prompt);
+  } catch {
+    result = null;
+  }
+  if (!result || typeof result.confidence !== 'number') {
+    return { simple: false, confidence: null, source: 'unavailable' };
+  }
+  return {
+    simple: result.route === 'fast' && result.confidence >= MIN_CONFIDENCE,
+    confidence: result.confidence,
+    source: 'router',
+  };
 }